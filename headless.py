@@ -0,0 +1,164 @@
+import logging
+import multiprocessing as mp
+import queue
+import sys
+from typing import Any, Dict, List
+
+from modules.camera import create_camera, load_camera_settings
+from modules.detection import load_detection_settings
+from modules.pipeline import (Pipeline, load_colors, load_json,
+                              run_pipeline_process)
+from modules.tools import abspath
+from modules.tracing import tracer
+from modules.ws_client import WsClient
+
+log = logging.getLogger('headless')
+
+
+class HeadlessNetwork(WsClient):
+    def on_exception(self, exc: str) -> None:
+        log.error('Network: %s', exc)
+
+
+class Headless:
+    """
+    Запуск без интерфейса: камера -> распознавание -> анализ дыхания ->
+    сигнал на сервер. Не импортирует PyQt5 и pyqtgraph
+    """
+
+    def __init__(self) -> None:
+        settings = load_json('data/settings/headless_settings.json')
+
+        # Логи пишем в файл или в stdout
+        logging.basicConfig(
+            filename=settings.get('log_file'),
+            level=settings.get('log_level', 'INFO'),
+            format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+        self.all_colors = load_colors()
+        self.default_colors: List[str] = settings.get('colors', [])
+
+        self.network = HeadlessNetwork()
+        server = load_json('data/settings/server_settings.json')
+        if settings.get('connect', True) and server.get('address'):
+            self.network.open_connection(address=server['address'],
+                                         token=server['token'])
+
+        self.detection_settings = load_detection_settings()
+        self.breath_settings = load_json(
+            'data/settings/breath_rec_settings.json')
+
+        # Настройки камер. Цвета меток можно задать для каждой камеры
+        self.cameras: List[Dict[str, Any]] = load_camera_settings()
+        self.colors = [self.select_colors(dct.get('colors',
+                                                  self.default_colors))
+                       for dct in self.cameras]
+
+        # Статистика каждой цепочки {num: (fps, cpu)}
+        self.stats: Dict[int, tuple] = {}
+
+        # Файл, в который при завершении сохраняются задержки обработки
+        self.latency_file = settings.get('latency_file')
+        # Задержки цепочек, работавших в отдельных процессах
+        self.latencies: Dict[str, dict] = {}
+
+    def select_colors(self, names: List[str]) -> Dict[str, List[List[int]]]:
+        # Выбираем цвета меток так же, как в главном окне
+        missing = [name for name in names if name not in self.all_colors]
+        if missing or len(names) != 2:
+            log.error('Two known colors expected, got %s (unknown: %s)',
+                      names, missing)
+            sys.exit(1)
+        return {name: self.all_colors[name] for name in names}
+
+    def run(self) -> None:
+        try:
+            if len(self.cameras) == 1:
+                self.run_single()
+            else:
+                self.run_processes()
+        except KeyboardInterrupt:
+            log.info('Interrupted')
+        finally:
+            self.network.disconnect()
+            if self.latency_file:
+                tracer.dump(abspath(self.latency_file),
+                            {'pipelines': self.latencies})
+                log.info('Latency saved to %s', self.latency_file)
+
+    def run_single(self) -> None:
+        # Одна камера обрабатывается в главном процессе
+        camera = create_camera(self.cameras[0])
+        pipeline = Pipeline(camera, self.colors[0], self.detection_settings,
+                            self.breath_settings, self.network)
+        log.info('Pipeline started')
+        try:
+            pipeline.run()
+        finally:
+            camera.disconnect_camera()
+
+    def run_processes(self) -> None:
+        # Каждая камера обрабатывается в своем процессе, чтобы цепочки не
+        # делили одну блокировку интерпретатора
+        events = mp.Queue()
+        processes = [
+            mp.Process(target=run_pipeline_process, name=f'Pipeline-{num}',
+                       daemon=True,
+                       args=(num, events, dct, self.colors[num],
+                             self.detection_settings, self.breath_settings))
+            for num, dct in enumerate(self.cameras)]
+        for process in processes:
+            process.start()
+        log.info('%d pipelines started', len(processes))
+
+        try:
+            running = len(processes)
+            while running:
+                try:
+                    event = events.get(timeout=1)
+                except queue.Empty:
+                    if not any(p.is_alive() for p in processes):
+                        break
+                    continue
+
+                if event[0] == 'signal':
+                    _, num, signal = event
+                    log.info('Camera %d breath | %s', num, signal)
+                    trace = signal.get('trace')
+                    if trace is not None:
+                        tracer.record('signal', trace['capture'],
+                                      trace['id'])
+                    # Сигналы всех камер уходят через одно соединение
+                    self.network.send_signal(trace)
+                elif event[0] == 'stats':
+                    _, num, fps, cpu, dropped = event
+                    self.stats[num] = (fps, cpu, dropped)
+                    self.log_stats()
+                elif event[0] == 'closed':
+                    _, num, frames, signals, latencies = event
+                    log.info('Camera %d closed: %d frames, %d breaths', num,
+                             frames, signals)
+                    self.latencies[f'Camera {num}'] = latencies
+                    running -= 1
+        finally:
+            for process in processes:
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.terminate()
+
+    def log_stats(self) -> None:
+        # Статистика по каждой камере и суммарная
+        if len(self.stats) < len(self.cameras):
+            return
+        for num, (fps, cpu, dropped) in sorted(self.stats.items()):
+            log.info('Camera %d: %.1f fps, CPU %.0f%%, dropped %d', num, fps,
+                     cpu, dropped)
+        log.info('Total: %.1f fps, CPU %.0f%%, dropped %d',
+                 sum(i[0] for i in self.stats.values()),
+                 sum(i[1] for i in self.stats.values()),
+                 sum(i[2] for i in self.stats.values()))
+        self.stats.clear()
+
+
+if __name__ == '__main__':
+    Headless().run()
@@ -1,8 +1,9 @@
+import logging
 import sys
 
 from PyQt5.QtWidgets import QApplication
 
-from modules.camera_views import Camera
+from modules.camera import create_cameras
 from modules.main_window import MainWindow
 from modules.network import Network
 
@@ -16,21 +17,31 @@ def exception_hook(exc_type, value, traceback):
 class Main:
     def __init__(self) -> None:
         self.network = Network()
-        self.camera = Camera()
+        self.cameras = create_cameras()
 
-        # Создаем приложение и запускаем главное окно
+        # Создаем приложение и запускаем главное окно для каждой камеры.
+        # У каждого окна свой поток (процесс) распознавания, анализатор и
+        # график, соединение с сервером общее
         app = QApplication(sys.argv)
+        app.aboutToQuit.connect(self.network.disconnect)
 
-        self.main_window = MainWindow(self.camera, self.network)
-        self.main_window.show()
+        self.main_windows = []
+        for num, camera in enumerate(self.cameras, start=1):
+            window = MainWindow(camera, self.network,
+                                num if len(self.cameras) > 1 else None)
+            window.show()
 
-        # Подключаем сигнал с ошибками к главному окно для их отображения
-        self.network.exceptionSignal.connect(
-            self.main_window.check_network_state)
+            # Подключаем сигнал с ошибками к главному окну для их отображения
+            self.network.exceptionSignal.connect(window.check_network_state)
+            self.main_windows.append(window)
 
         sys.exit(app.exec())
 
 
 if __name__ == '__main__':
     sys.excepthook = exception_hook
+    # Решения регулятора качества и статистика пишутся в лог
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     Main()
@@ -2,11 +2,12 @@ import json
 from typing import List
 
 from PyQt5 import uic
-from PyQt5.QtCore import Qt, pyqtSlot
+from PyQt5.QtCore import QRect, Qt, pyqtSlot
 from PyQt5.QtGui import QCloseEvent, QImage, QPixmap
 from PyQt5.QtWidgets import QMessageBox
 
 from modules.analyzer import Graph
+from modules.calibration import propose_range
 from modules.camera_views import ColorRangeCamera
 from modules.myQElements import AutoClosedQWidget
 from modules.tools import abspath
@@ -53,6 +54,11 @@ class ColorRangeWindow(AutoClosedQWidget):
 
         self.reset_btn.clicked.connect(self.reset_color)
 
+        # Калибровка по остановленному кадру
+        self.freeze_btn.toggled.connect(self.freeze_frame)
+        self.pick_region_btn.toggled.connect(self.VideoBox.set_selecting)
+        self.VideoBox.regionSelected.connect(self.pick_region)
+
         # Загружаем все цвета из файла
         self.load_colors()
 
@@ -112,6 +118,53 @@ class ColorRangeWindow(AutoClosedQWidget):
 
     def set_camera_hsv_colors(self) -> None:
         self.camera.set_hmin_hmax(*self.get_hsv_min_max())
+        self.show_pixels_count()
+
+    def freeze_frame(self, flag: bool) -> None:
+        # Остановка кадра для калибровки по гистограмме
+        if flag:
+            if not self.camera.freeze():
+                self.freeze_btn.setChecked(False)
+                return
+            self.set_camera_hsv_colors()
+        else:
+            self.pick_region_btn.setChecked(False)
+            self.camera.unfreeze()
+            self.pixels_label.clear()
+
+    def show_pixels_count(self) -> None:
+        # Количество пикселей остановленного кадра, попавших в диапазон
+        histogram = self.camera.histogram
+        if histogram is None:
+            return
+        count = histogram.count(*self.get_hsv_min_max())
+        self.pixels_label.setText(
+            f'Пикселей в диапазоне: {count} '
+            f'({count / histogram.total * 100:.1f}%)')
+
+    def pick_region(self, rect: QRect) -> None:
+        # Предлагаем диапазон цвета по выделенной на кадре области
+        if not self.camera.frozen:
+            self.freeze_btn.setChecked(True)
+        if not self.camera.frozen:
+            return
+
+        # Переводим область из координат картинки в координаты кадра
+        hsv = self.camera.histogram.hsv
+        k = hsv.shape[1] / self.VideoBox.pixmap().width()
+        x0, y0 = int(rect.left() * k), int(rect.top() * k)
+        x1, y1 = int((rect.right() + 1) * k), int((rect.bottom() + 1) * k)
+        region = hsv[y0:y1, x0:x1]
+        if not region.size:
+            return
+
+        hsv_min, hsv_max = propose_range(region)
+        for slider, value in zip(
+                [self.st_hue_slider, self.st_sat_slider, self.st_val_slider,
+                 self.end_hue_slider, self.end_sat_slider,
+                 self.end_val_slider], hsv_min + hsv_max):
+            slider.setValue(value)
+        self.pick_region_btn.setChecked(False)
 
     def is_color_edited(self) -> bool:
         # Получаем название цвета и его сохраненное значание
@@ -346,7 +399,7 @@ class GraphWindow(AutoClosedQWidget):
         super().__init__(parent)
         uic.loadUi(abspath('data/ui/graph_window.ui'), self)
 
-        self.graph = Graph(parent.analyzer, self.graphicsView, orig=False)
+        self.graph = Graph(parent.analyzer, self.graphicsView)
 
         # Добавляем в список графиков, чтобы одновременно обновлять кривые
         self.parent.analyzer.add_graph(self.graph)
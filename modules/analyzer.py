@@ -1,24 +1,32 @@
 import colorsys
-from typing import Any, Dict, List, Tuple
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
-import pyqtgraph as pg
 from PyQt5.QtCore import QObject, pyqtSignal
 
+from modules.breath import StreamingBreathDetector
+from modules.recorder import SessionRecorder, session_path
+from modules.samples import (Y, SampleQueue, SampleStore, Samples,
+                             record_columns)
+from modules.scheduler import Scheduler
+from modules.tracing import tracer
+
 
 class Graph:
-    def __init__(self, analyzer, graphics_view, orig=True) -> None:
+    """
+    Представление общего массива координат анализатора. Не хранит
+    собственных данных и перерисовывается по уведомлению о новых записях
+    """
+
+    def __init__(self, analyzer, graphics_view) -> None:
         # np.seterr(all='ignore')
 
         # Объект анализатора, из которого получаем координаты
         self.analyzer: Analyzer = analyzer
 
-        # Флаг оригинальстости графика
-        self.orig: bool = orig
-
-        self.startTime = pg.ptime.time()
-
-        # Объект, на котором будет рисоваться график
+        # Виджет и объект, на котором будет рисоваться график
+        self.view = graphics_view
         self.pl = graphics_view.addPlot()
 
         self.pl.setLabel('bottom', 'Time', 's')
@@ -29,30 +37,22 @@ class Graph:
         # Кривые, которые уже отображались на графике
         self.saved_curves: Dict[int: Dict[str: Any]] = {}
 
-        # Максимально количество данных для сохранения
-        self.maxChunks: int = 300
-        self.save_full_data: bool = False
-
-        # Массив данных, заполненный нулями для двух кривых.
-        self.data: np.ndarray = np.zeros((self.maxChunks, 5))
-
-        # Счетчик для данных. Изменяется во времени
-        self.ptr: int = 0
-
-        # Таймер, который будет срабатывать каждые 50 миллисекунд,
-        # и обновлять данные в графике
-        self.timer = pg.QtCore.QTimer()
-        self.timer.timeout.connect(self.update)
-        self.timer.start(100)
-
-        # Если создается график в окне, и нам необходимо в нем отображать
-        # данные главного графика, копируем значения из главного графика
-        if not orig:
-            self.startTime = self.analyzer.main_graph.startTime
-            self.maxChunks = self.analyzer.main_graph.maxChunks
-            self.save_full_data = self.analyzer.main_graph.save_full_data
-            self.timer.setInterval(self.analyzer.main_graph.timer.interval())
-            self.reload_curves()
+        # Подписываемся на новые записи в общем массиве
+        self.analyzer.samplesAdded.connect(self.on_samples)
+        self.pl.getViewBox().sigXRangeChanged.connect(self.on_range_changed)
+        self.reload_curves()
+
+    @property
+    def store(self) -> SampleStore:
+        return self.analyzer.store
+
+    @property
+    def data(self) -> Samples:
+        return self.store.data
+
+    def detach(self) -> None:
+        # Отписываемся от анализатора при закрытии окна графика
+        self.analyzer.samplesAdded.disconnect(self.on_samples)
 
     def reload_curves(self) -> None:
         # Сохраняем объекты кривых, для последующего редактирования
@@ -68,6 +68,7 @@ class Graph:
                        if val['name'] is not None}
 
         self.check_saved_curves()
+        self.redraw(*self.plot_range())
 
     def check_saved_curves(self) -> None:
         if len(self.saved_curves) <= 1:
@@ -83,71 +84,48 @@ class Graph:
 
                     # Устанавливаем кривой белый цвет и отрисовываем
                     curve.setPen((255, 255, 255))
-                    curve.setData(x=self.data[:self.ptr, 0],
-                                  y=self.data[:self.ptr, num])
+                    data = self.data
+                    curve.setData(x=data.times, y=data.coords[:, num - 1, Y])
 
-    def update(self) -> None:
-        now = pg.ptime.time()
-
-        # Увеличиваем счетчик
-        self.ptr += 1
-
-        # Увеличиваем размерность массива данных при переполнении
-        if self.ptr >= self.data.shape[0]:
-            # Также очищаем массив c обнаруженными пиками
-            self.analyzer.detected_peaks = self.analyzer.detected_peaks[
-                                           -self.analyzer.leave_det_peaks:]
-
-            tmp = self.data
-
-            # Если не сохраняем весь массив
-            if not self.save_full_data:
-                # Обвноялвяем массив
-                self.data = np.zeros((self.maxChunks, 5))
-
-                # Перемащаем в него копию последних 1/4 значений
-                self.data[:tmp.shape[0] // 4] = tmp[-tmp.shape[0] // 4:]
-
-                # Перемещаем счетчик
-                self.ptr = tmp.shape[0] // 4
-
-                # Очищаем график от старых значений
-                if self.curves:
-                    self.pl.clear()
-                    self.curves.clear()
-                    self.saved_curves.clear()
-                    self.reload_curves()
-            else:
-                # Увеличиваем массив вдвое
-                self.data = np.zeros((self.data.shape[0] * 2, 5))
-                self.data[:tmp.shape[0]] = tmp
-
-        # Указываем координату времени
-        self.data[self.ptr, 0] = now - self.startTime
-
-        if not self.orig and self.analyzer.colors:
-            orig = self.analyzer.graphs[0]
-            self.data = orig.data
-            self.ptr = orig.ptr
-
-        # Перебираем цвета, и отображаем их координаты на графике
-        for num, val in self.analyzer.colors.items():
-            if num not in self.curves:
-                continue
-            # Устанавливаем координату Y цвета
-            y = val['pos'][0] if 'pos' in val else 0
-            x = val['pos'][1] if 'pos' in val else 0
-            self.data[self.ptr, num] = y
-            self.data[self.ptr, num + 2] = x
-
-            # Отрисовываем на графике
-            self.curves[num]['curve'].setData(x=self.data[:self.ptr, 0],
-                                              y=self.data[:self.ptr, num])
-
-        # Сигналем в анализаторе о том, что появились новые координаты
-        self.analyzer.newCoordinatesSignal.emit()
+    def on_samples(self, count: int) -> None:
+        """
+        Добавлены новые записи
+        :param count: Количество новых записей
+        """
+        if not self.curves or not self.view.isVisible():
+            return
 
-        self.analyzer.analyse()
+        # Новые записи вне видимого отрезка не меняют картинку
+        width, t0, t1 = self.plot_range()
+        if t1 is not None and t1 < self.store.view(count).times[0]:
+            return
+        self.redraw(width, t0, t1)
+
+    def on_range_changed(self) -> None:
+        # При ручном перемещении и масштабировании прореживаем данные
+        # под новый видимый отрезок
+        if not self.pl.getViewBox().autoRangeEnabled()[0]:
+            self.redraw(*self.plot_range())
+
+    def redraw(self, width: int, t0: Optional[float] = None,
+               t1: Optional[float] = None) -> None:
+        # Отображаем координаты цветов на графике. Передаются только
+        # видимые данные, прореженные до пары минимум/максимум на пиксель
+        times, mins, maxs = self.store.plot_data(width, t0, t1)
+        x = np.repeat(times, 2)
+        for num, val in self.curves.items():
+            y = np.column_stack((mins[:, num - 1, Y], maxs[:, num - 1, Y]))
+            val['curve'].setData(x=x, y=y.ravel())
+
+    def plot_range(self) -> Tuple[int, Optional[float], Optional[float]]:
+        # Ширина графика в пикселях и видимый отрезок времени. При
+        # автомасштабе отображается вся запись
+        view = self.pl.getViewBox()
+        width = max(int(view.width()), 100)
+        if view.autoRangeEnabled()[0]:
+            return width, None, None
+        t0, t1 = view.viewRange()[0]
+        return width, t0, t1
 
     def get_rgb_by_name(self, name: str) -> list:
         """
@@ -169,205 +147,158 @@ class Graph:
         """ Имеются ли на графике какие-либо кривые"""
         return bool(self.curves)
 
-    def set_new_settings(self, **settings: [str, Any]) -> None:
-        """ Обновляем настройки графика"""
-        for k, v in settings.items():
-            if k == 'timer_interval':
-                self.timer.setInterval(settings[k])
-            else:
-                try:
-                    getattr(self, k)
-                    setattr(self, k, settings[k])
-                except AttributeError:
-                    continue
 
+class Analyzer(QObject, StreamingBreathDetector):
+    # Количество записей, добавленных в общий массив с прошлой
+    # перерисовки графиков
+    samplesAdded = pyqtSignal(int)
 
-class Analyzer(QObject):
-    newCoordinatesSignal = pyqtSignal()
+    # Настройки периодов (мс) и задачи планировщика, к которым они
+    # относятся
+    INTERVALS = {'ingest_interval': 'ingest', 'timer_interval': 'analyse',
+                 'plot_interval': 'plot', 'label_interval': 'labels'}
 
     def __init__(self, main) -> None:
-        super().__init__(main)
+        QObject.__init__(self, main)
+        StreamingBreathDetector.__init__(self)
         self.parent = main
 
         self.colors: Dict[int, dict] = {}
 
-        # Массив с данными, а также таймер срабатывания регистрации точек в
-        # массиве находятся в главном графике, который создается здесь.
+        # Номер кривой для каждого имени цвета. Пересчитывается только при
+        # смене цветов
+        self.slots: Dict[str, int] = {}
+
+        # Очередь координат с камеры с временем захвата кадров
+        self.samples: SampleQueue = SampleQueue()
+
+        # Общий массив координат для всех графиков. Время отсчитывается
+        # от того же часового источника, что и время захвата кадров
+        self.store: SampleStore = SampleStore()
+        self.startTime: float = time.time()
+        # Кадры идут в реальном времени. Время кадров записи без realtime -
+        # время в записи, и задержки по нему не считаются
+        self.realtime: bool = True
+
+        # Количество принятых записей. В отличие от store.count не
+        # меняется при изменении размера массива
+        self.received: int = 0
+        self._plotted: int = 0
+
+        # Прием координат, анализ и перерисовка графиков выполняются по
+        # тактам общего планировщика окна и пропускаются, если новых
+        # записей не было
+        self.scheduler: Scheduler = main.scheduler
+        self.scheduler.add('ingest', self.ingest, 50,
+                           lambda: self.samples.pushed)
+        self.scheduler.add('analyse', self.analyse, 100,
+                           lambda: self.received)
+        self.scheduler.add('plot', self.refresh_graphs, 100,
+                           lambda: self.received)
+
         self.main_graph: Graph = Graph(self, self.parent.graphicsView)
         self.graphs: List[Graph] = [self.main_graph]
 
-        # Временной отрезок, который надо проанализировать (мс)
-        tm_delta: int = 2000
-
-        # Размер массива для анализа
-        self.len_analyseData: int = self.set_len_analyse_data(tm_delta)
-
-        # Список с метками времени, которые уже были обнаружены
-        self.detected_peaks: List[float] = []
-        self.leave_det_peaks: int = 10
+    @property
+    def maxChunks(self) -> int:
+        # Максимально количество данных для сохранения
+        return self.store.maxChunks
 
-        # Коэфф сглаживания
-        self.window_len: int = 20
+    @maxChunks.setter
+    def maxChunks(self, value: int) -> None:
+        self.store.resize(value)
 
-        self.delta_top: List[int, int] = [0, 0]
-        self.delta_bot: List[int, int] = [0, 0]
+    @property
+    def save_full_data(self) -> bool:
+        return self.store.save_full_data
 
-    def analyse(self) -> None:
-        """
-        Предварительная фильтровка данных и получение экстремумов
-        :return:
-        """
-        if not self.graphs[0].is_active() or \
-                len(self.graphs[0].curves) < 2:
-            return
+    @save_full_data.setter
+    def save_full_data(self, value: bool) -> None:
+        self.store.save_full_data = value
 
-        data = self.get_analyse_data()
+    @property
+    def record_session(self) -> bool:
+        # Записываются ли координаты в файл сеанса
+        return self.store.recorder is not None
 
-        # Если все значения по X и Y одного элемента равны 0, то не анализируем
-        if all(map(lambda x: x[1] == 0 and x[3] == 0, data)) or \
-                all(map(lambda x: x[2] == 0 and x[4] == 0, data)):
+    @record_session.setter
+    def record_session(self, value: bool) -> None:
+        if value == self.record_session:
             return
-
-        # Если точки меняют положение по X между собой, то не анализируем
-        if (not all(map(lambda x: x[3] > x[4], data))) and \
-                (not all(map(lambda x: x[4] > x[3], data))):
+        if value:
+            name = '' if self.parent.num is None else \
+                f'camera{self.parent.num}'
+            self.store.recorder = SessionRecorder(
+                session_path(name), self.startTime,
+                record_columns(self.store.markers))
+        else:
+            self.close_recorder()
+
+    def close_recorder(self) -> None:
+        if self.store.recorder is not None:
+            self.store.recorder.close()
+            self.store.recorder = None
+
+    def ingest(self) -> None:
+        # Переносим в массив все координаты, пришедшие с камеры
+        samples = self.samples.drain()
+        if not samples:
             return
+        self.add_samples(samples)
+        self.received += len(samples)
+
+    def refresh_graphs(self) -> None:
+        # Графики дорисовывают записи, принятые с прошлой перерисовки
+        count, self._plotted = self.received - self._plotted, self.received
+        self.samplesAdded.emit(count)
+
+    def add_samples(self, samples: list) -> None:
+        nums = list(self.slots.values())
+        for timestamp, positions, trace in samples:
+            if self.realtime:
+                tracer.record('graph', timestamp)
+
+            # Время кадра отсчитываем от начала работы анализатора
+            lap = self.store.append(timestamp - self.startTime, positions,
+                                    nums, trace)
+            self.push_sample(self.store.get_last())
+            if lap:
+                # Кольцо прошло круг - оставляем только последние
+                # обнаруженные пики
+                self.trim_detected_peaks()
 
-        # Вытаскиваем из данных только значения по Y для каждой прямой
-        y1_graph = np.array([int(data[i][1]) for i in range(data.shape[0])])
-        y2_graph = np.array([int(data[i][2]) for i in range(data.shape[0])])
-
-        # Сглаживаем прямые
-        y1_smooth: np.ndarray = self.smooth_line(y1_graph)
-        y2_smooth: np.ndarray = self.smooth_line(y2_graph)
-
-        # Находим пики для каждой сглаженной прямой
-        y1_peaks: List = self.find_peaks(y1_smooth)
-        y2_peaks: List = self.find_peaks(y2_smooth)
-
-        self.analyse_peaks(y1_peaks, y2_peaks, data)
-
-    def analyse_peaks(self, y1_p: List[List[int]], y2_p: List[List[int]],
-                      data: np.ndarray) -> None:
+    def analyse(self) -> None:
         """
-        Анализирование экстремумов
-        :param y1_p - y1_peaks
-        :param y2_p - y2_peaks
-        :param data - dictionary with all data
-        :return: None
+        Анализ последнего среза данных главного графика
+        :return:
         """
-        y1_max_p, y1_min_p = y1_p[1], y1_p[2]
-        y2_max_p, y2_min_p = y2_p[1], y2_p[2]
-
-        # Если экстремумов недостаточно - выходим
-        if len(y1_p[0]) < 3 and len(y2_p[0]) < 3:
+        if len(self.slots) < 2 or not self.store.count:
             return
 
-        # Если и максимумов и минимумов больше, чем необходимо,
-        # получаем последний всплеск
-        if len(y1_max_p) > 2 and len(y1_min_p) > 1:
-            y1_max_p, y1_min_p = self.find_last_peak(y1_max_p, y1_min_p)
-        if len(y2_max_p) > 2 and len(y2_min_p) > 1:
-            y2_max_p, y2_min_p = self.find_last_peak(y2_max_p, y2_min_p)
-
-        # Если обнаружено нужное количество максимумов и миниимумов,
-        # то проверяем подходит ли всплеск под нормативы
-        if (len(y1_max_p) == 2 and len(y1_min_p) == 1) and \
-                (len(y2_max_p) == 2 and len(y2_min_p) == 1):
-
-            # Координата времени в которую был зафиксирован пик всплеска
-            p1_time, p2_time = data[y1_min_p[0]][0], data[y2_min_p[0]][0]
-
-            # Преобразуем номера вершин в их координаты (y, x)
-            y1_max_p = list(map(lambda x: (data[x][1], data[x][3]), y1_max_p))
-            y1_min_p = (data[y1_min_p[0]][1], data[y1_min_p[0]][3])
-            y2_max_p = list(map(lambda x: (data[x][2], data[x][4]), y2_max_p))
-            y2_min_p = (data[y2_min_p[0]][1], data[y2_min_p[0]][3])
-
-            # Получаем установленную дельту для верхей и нижней точек
-            is_y1_top = True if y1_min_p[1] < y2_min_p[1] else False
-            normal_delta1 = self.delta_top if is_y1_top else self.delta_bot
-            normal_delta2 = self.delta_bot if is_y1_top else self.delta_top
-
-            delta1 = sum(map(lambda x: x[0], y1_max_p)) // 2 - y1_min_p[0]
-            delta2 = sum(map(lambda x: x[0], y2_max_p)) // 2 - y2_min_p[0]
-
-            if normal_delta1[0] <= delta1 <= normal_delta1[1] and \
-                    normal_delta2[0] <= delta2 <= normal_delta2[1] and \
-                    p1_time not in self.detected_peaks and \
-                    p2_time not in self.detected_peaks:
-
-                self.process_signal(self.create_data(p1_time, [delta1, delta2],
-                                                     is_y1_top,
-                                                     [y1_max_p, y1_min_p,
-                                                     y2_max_p, y2_min_p]))
-                # Сохраняем время вершины всплеска, чтобы несколько раз
-                # подряд не обрабатывать один и тот-же всплеск
-                self.detected_peaks.extend([p1_time, p2_time])
-
-    def smooth_line(self, array: np.ndarray) -> np.ndarray:
-        """
-        Сглаживание кривой
-        :param: numpy.ndarray
-        :return: numpy.ndarray
-        """
-        kernel = np.ones(self.window_len, dtype=float) / self.window_len
-        return np.convolve(array, kernel, 'same')
-
-    @staticmethod
-    def find_last_peak(max_peaks: List[int], min_peaks: List[int]) -> tuple:
-        """
-        Возвращает последний всплеск из переданных значений
-        :param max_peaks: Все верхние экстремумы
-        :param min_peaks: Все нижние экстремумы
-        :return: [[max_peak1, max_peak2], [min_peak]]
-        """
-        f = max(max_peaks)
-        m = sorted(filter(lambda x: x < f, min_peaks))[-1]
-        s = sorted(filter(lambda x: x < m, max_peaks))[-1]
-        return [s, f], [m]
-
-    @staticmethod
-    def find_peaks(array: np.ndarray) -> List[List[int]]:
-        # Находим экстремумы используя втроенную функцию
-        row_peaks = np.diff(np.sign(np.diff(array)))
+        signal = self.detect(self.get_analyse_data())
+        if self.realtime:
+            # Задержка анализа от захвата последнего кадра среза
+            tracer.record('analyse',
+                          self.startTime + float(self.store.view(1).times[0]))
+        if signal is None:
+            return
 
-        peaks: List[int] = row_peaks.nonzero()[0] + 1
-        peaks_min: List[int] = (row_peaks > 0).nonzero()[0] + 1
-        peaks_max: List[int] = (row_peaks < 0).nonzero()[0] + 1
-        return [peaks, peaks_max, peaks_min]
-
-    @staticmethod
-    def create_data(time: float, deltas: list, is_y1_top: bool,
-                    peaks: list) -> dict:
-        d1, d2 = deltas
-        max_p1, min_p1, max_p2, min_p2 = peaks
-        # Проебразуем данные о всплеске
-        data = {
-            'time': round(time, 2),
-            'upper': {
-                'delta': d1 if is_y1_top else d2,
-                'max': list(map(lambda x: x[0],
-                                max_p1 if is_y1_top else max_p2)),
-                'min': min_p1[0] if is_y1_top else min_p2[0]
-            }, 'lower': {
-                'delta': d2 if is_y1_top else d1,
-                'max': list(map(lambda x: x[0],
-                                max_p2 if is_y1_top else max_p1)),
-                'min': min_p2[0] if is_y1_top else min_p1[0]
-            }
-        }
-        return data
-
-    def set_len_analyse_data(self, tm_delta: int) -> int:
-        # Устанавливаем размер среза данных в зависимости от времени
-        return tm_delta // self.graphs[0].timer.interval()
+        if self.realtime:
+            # Привязываем вдох к кадру, в котором был минимум всплеска
+            capture = self.startTime + self.last_peak_time
+            signal['trace'] = {
+                'id': self.store.find_trace(self.last_peak_time),
+                'capture': capture}
+            tracer.record('breath', capture, signal['trace']['id'])
+        self.process_signal(signal)
 
     def set_new_settings(self, **settings: [str, Any]) -> None:
         # Обновляем настройки анализатора
         for k, v in settings.items():
             if k == 'timeDelta':
-                self.len_analyseData = self.set_len_analyse_data(settings[k])
+                self.tm_delta = settings[k]
+            elif k in self.INTERVALS:
+                self.scheduler.set_interval(self.INTERVALS[k], v)
             else:
                 try:
                     # Пробуем найти в собственном классе необходимый атрибут
@@ -375,17 +306,38 @@ class Analyzer(QObject):
                     # Изменяем значение атрибута, если нашли
                     setattr(self, k, v)
                 except AttributeError:
-                    # Проверяем имеется ли атрибут в объектах графиков
-                    [i.set_new_settings(**{k: v}) for i in self.graphs]
                     continue
 
-    def add_next_position(self, name: str, position: Tuple[int, int]) -> None:
-        # Полученный цвет загружаем в соответствующий блок
-        self.colors[self.get_key_by_name(name)]['pos'] = position
+    def push_positions(self, timestamp: float,
+                       positions: Dict[str, Tuple[int, int]],
+                       trace: int = -1) -> None:
+        """
+        Передает координаты меток одного кадра в очередь графика.
+        Вызывается из потока камеры
+        :param timestamp: Время захвата кадра
+        :param positions: {name: (x, y)}
+        :param trace: Номер кадра
+        """
+        slots = self.slots
+        self.samples.push(timestamp, {slots[name]: pos
+                                      for name, pos in positions.items()
+                                      if name in slots}, trace)
 
     def update_colors(self, new_colors: Dict[int, Dict[str, str]]) -> None:
         # Обновляем набор цветов
         self.colors = new_colors
+        self.slots = {val['name']: num for num, val in new_colors.items()
+                      if val['name'] is not None}
+
+        # Столбцы массива под все номера кривых, но не меньше двух меток
+        # для распознавания вдоха
+        markers = max([2, *new_colors])
+        if markers != self.store.markers:
+            # Файл сеанса начинается заново с новым набором столбцов
+            recording = self.record_session
+            self.record_session = False
+            self.store.set_markers(markers)
+            self.record_session = recording
 
         # Перезагружаем кривые графиков
         [graph.reload_curves() for graph in self.graphs]
@@ -395,22 +347,22 @@ class Analyzer(QObject):
                                 self.colors.items()))
         return arr[0][0] if arr else -1
 
-    def get_last_coordinates(self) -> List[int]:
-        return self.main_graph.data[self.main_graph.ptr][1:]
+    def get_last_coordinates(self) -> np.ndarray:
+        # Последние координаты меток [метка, (y, x)]
+        return self.store.get_last()
 
-    def get_analyse_data(self) -> np.ndarray:
-        # Возвращает срех данных для анализа
-        return self.main_graph.data[
-               self.main_graph.ptr - self.len_analyseData
-               if self.main_graph.ptr > self.len_analyseData
-               else 0: self.main_graph.ptr]
+    def get_analyse_data(self) -> Samples:
+        # Возвращает срез данных для анализа за последние tm_delta мс
+        return self.store.get_window(self.tm_delta / 1000)
 
     def get_current_settings(self) -> Dict[str, Any]:
         # Собираем сохрняемые данные
         return {'window_len': self.window_len,
-                'save_full_data': self.main_graph.save_full_data,
-                'timer_interval': self.main_graph.timer.interval(),
-                'maxChunks': self.main_graph.maxChunks}
+                'save_full_data': self.save_full_data,
+                'maxChunks': self.maxChunks,
+                'record_session': self.record_session,
+                **{k: self.scheduler.interval(v)
+                   for k, v in self.INTERVALS.items()}}
 
     def add_graph(self, graph: Graph) -> None:
         self.graphs.append(graph)
@@ -418,6 +370,7 @@ class Analyzer(QObject):
     def remove_graph(self, graph: Graph) -> None:
         if graph in self.graphs:
             self.graphs.remove(graph)
+            graph.detach()
 
     def process_signal(self, data: Dict[Any, Any]) -> None:
         # Обрабатываем сигнал
@@ -0,0 +1,716 @@
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from modules.samples import X, Y, Samples, ring_size
+
+
+def tick_windows(times: np.ndarray, interval: float, tm_delta: float,
+                 max_chunks: int) -> np.ndarray:
+    """
+    Срезы, которые анализатор получает при каждом срабатывании таймера:
+    записи поступают в массив и раз в interval секунд анализируется срез
+    за последние tm_delta секунд из последних max_chunks записей
+    :return: Массив (start, end) номеров записей
+    """
+    ticks = np.arange(times[0], times[-1] + interval, interval)
+    ends = np.unique(np.searchsorted(times, ticks, side='right'))
+    ends = ends[ends > 0]
+    starts = np.maximum(np.searchsorted(times, times[ends - 1] - tm_delta,
+                                        side='left'), ends - max_chunks)
+    return np.column_stack((starts, ends))
+
+
+def smooth_kernel(window_len: int) -> np.ndarray:
+    # Ядро скользящего среднего
+    return np.ones(window_len, dtype=float) / window_len
+
+
+def smooth_signs(values: np.ndarray, window_len: int) -> np.ndarray:
+    """
+    Знаки приращений сглаженной кривой там, где окно сглаживания целиком
+    лежит внутри кривой. Первый знак - приращение в точке
+    window_len // 2. Значения np.convolve в таких точках не зависят от
+    того, в каком срезе они посчитаны, поэтому знаки совпадают с
+    полученными через smooth_line
+    """
+    return np.sign(np.diff(np.convolve(values, smooth_kernel(window_len),
+                                       'valid')))
+
+
+def last_true(mask: np.ndarray) -> np.ndarray:
+    # Для каждой записи - номер последней записи не позже нее, в которой
+    # mask истинна, или -1. Записи по последней оси
+    idx = np.where(mask, np.arange(mask.shape[-1]), -1)
+    return np.maximum.accumulate(idx, axis=-1)
+
+
+class BreathDetector:
+    """
+    Распознавание вдоха по координатам двух меток. Не зависит от Qt и
+    графиков, поэтому используется и в окне, и в режиме без интерфейса
+    """
+
+    def __init__(self) -> None:
+        # Номера меток в записях, по которым распознается вдох
+        self.markers: Tuple[int, int] = (0, 1)
+
+        # Временной отрезок, который надо проанализировать (мс)
+        self.tm_delta: int = 2000
+
+        # Список с метками времени, которые уже были обнаружены
+        self.detected_peaks: List[float] = []
+        self.leave_det_peaks: int = 10
+
+        # Коэфф сглаживания
+        self.window_len: int = 20
+        # Доля кадров, которые попадают в анализ. Если обрабатывается
+        # только часть кадров, то окно сглаживания уменьшается, чтобы
+        # охватывать тот же отрезок времени
+        self.window_scale: float = 1
+
+        self.delta_top: List[int, int] = [0, 0]
+        self.delta_bot: List[int, int] = [0, 0]
+
+        # Точное время минимума последнего распознанного всплеска
+        self.last_peak_time: float = 0
+
+    def detect(self, data: Samples) -> Optional[Dict[str, Any]]:
+        """
+        Предварительная фильтровка данных и получение экстремумов
+        :param data: Срез записей
+        :return: Данные о вдохе или None
+        """
+        peaks = self.prepare(data)
+        if peaks is None:
+            return None
+        return self.analyse_peaks(*peaks, data)
+
+    def prepare(self, data: Samples) -> Optional[Tuple[list, list]]:
+        """
+        Фильтровка, сглаживание и поиск экстремумов. Не зависит от
+        допустимых дельт и уже обнаруженных пиков
+        :param data: Срез записей
+        :return: (y1_peaks, y2_peaks) или None, если срез не подходит
+        """
+        # Две метки срезом, без копирования
+        m1, m2 = self.markers
+        coords = data.coords[:, m1:m2 + 1:m2 - m1] if m2 > m1 else \
+            data.coords[:, [m1, m2]]
+        n = coords.shape[0]
+        if not n:
+            return None
+
+        # Если все значения по X и Y одного элемента равны 0, то не анализируем
+        if not coords.any(axis=(0, 2)).all():
+            return None
+
+        # Если точки меняют положение по X между собой, то не анализируем
+        x1, x2 = coords[:, 0, X], coords[:, 1, X]
+        if not ((x1 > x2).all() or (x1 < x2).all()):
+            return None
+
+        # Сглаживаем прямые и находим пики по смене знака приращений.
+        # На ровных участках знак нулевого приращения задает погрешность
+        # np.convolve, поэтому сглаживание именно через него
+        smooth = self.smooth_lines(coords[:, :, Y])
+        y1_peaks, y2_peaks = self.split_peaks(
+            np.diff(np.sign(np.diff(smooth, axis=0)), axis=0).T)
+        return y1_peaks, y2_peaks
+
+    def analyse_peaks(self, y1_p: List[List[int]], y2_p: List[List[int]],
+                      data: Samples) -> Optional[Dict[str, Any]]:
+        """
+        Анализирование экстремумов
+        :param y1_p - y1_peaks
+        :param y2_p - y2_peaks
+        :param data - срез записей, по которому найдены экстремумы
+        :return: Данные о вдохе или None
+        """
+        idx = self.select_peaks(y1_p, y2_p)
+        if idx is None:
+            return None
+
+        # Координаты (y, x) вершин одним обращением к массиву: максимумы
+        # и минимум первой прямой, затем максимумы второй. Минимум второй
+        # прямой, как и в исходном коде (data[y2_min_p[0]][1]), берется
+        # с первой прямой. Поведение сохранено намеренно: замена на m2
+        # изменит дельты и найденные вдохи
+        m1, m2 = self.markers
+        points = data.coords[idx, [m1, m1, m1, m2, m2, m1]]
+        (a1, b1, low1, a2, b2, low2), xs = points.T.tolist()
+
+        # Координата времени в которую был зафиксирован пик всплеска
+        p1_time, p2_time = data.times[[idx[2], idx[5]]].tolist()
+
+        # Получаем установленную дельту для верхей и нижней точек
+        is_y1_top = xs[2] < xs[5]
+        normal_delta1 = self.delta_top if is_y1_top else self.delta_bot
+        normal_delta2 = self.delta_bot if is_y1_top else self.delta_top
+
+        delta1 = (a1 + b1) // 2 - low1
+        delta2 = (a2 + b2) // 2 - low2
+
+        if normal_delta1[0] <= delta1 <= normal_delta1[1] and \
+                normal_delta2[0] <= delta2 <= normal_delta2[1] and \
+                p1_time not in self.detected_peaks and \
+                p2_time not in self.detected_peaks:
+
+            # Сохраняем время вершины всплеска, чтобы несколько раз
+            # подряд не обрабатывать один и тот-же всплеск
+            self.detected_peaks.extend([p1_time, p2_time])
+            self.last_peak_time = p1_time
+
+            return self.create_data(p1_time, [delta1, delta2], is_y1_top,
+                                    [points[0:2], points[2],
+                                     points[3:5], points[5]])
+        return None
+
+    def select_peaks(self, y1_p: List[List[int]],
+                     y2_p: List[List[int]]) -> Optional[List[int]]:
+        """
+        Выбор всплеска из экстремумов обеих прямых
+        :return: Номера вершин [max1, max1, min1, max2, max2, min2] или
+        None, если подходящего всплеска нет
+        """
+        y1_max_p, y1_min_p = y1_p[1], y1_p[2]
+        y2_max_p, y2_min_p = y2_p[1], y2_p[2]
+
+        # Если экстремумов недостаточно - выходим
+        if len(y1_p[0]) < 3 and len(y2_p[0]) < 3:
+            return None
+
+        # Если и максимумов и минимумов больше, чем необходимо,
+        # получаем последний всплеск
+        if len(y1_max_p) > 2 and len(y1_min_p) > 1:
+            y1_max_p, y1_min_p = self.find_last_peak(y1_max_p, y1_min_p)
+        if len(y2_max_p) > 2 and len(y2_min_p) > 1:
+            y2_max_p, y2_min_p = self.find_last_peak(y2_max_p, y2_min_p)
+
+        # Если обнаружено нужное количество максимумов и миниимумов,
+        # то проверяем подходит ли всплеск под нормативы
+        if not (len(y1_max_p) == 2 and len(y1_min_p) == 1 and
+                len(y2_max_p) == 2 and len(y2_min_p) == 1):
+            return None
+        return [y1_max_p[0], y1_max_p[1], y1_min_p[0],
+                y2_max_p[0], y2_max_p[1], y2_min_p[0]]
+
+    def smooth_line(self, array: np.ndarray) -> np.ndarray:
+        """
+        Сглаживание кривой
+        :param: numpy.ndarray
+        :return: numpy.ndarray
+        """
+        return np.convolve(array, self.smooth_kernel(), 'same')
+
+    def smooth_lines(self, lines: np.ndarray) -> np.ndarray:
+        """
+        Сглаживание нескольких кривых, как в smooth_line
+        :param lines: Значения кривых по столбцам
+        :return: numpy.ndarray. Если кривые короче окна, то длиной в окно
+        """
+        kernel = self.smooth_kernel()
+        return np.column_stack([np.convolve(i, kernel, 'same')
+                                for i in lines.T])
+
+    def smooth_kernel(self) -> np.ndarray:
+        return smooth_kernel(self.smooth_window())
+
+    def smooth_window(self) -> int:
+        # Длина окна сглаживания с учетом доли обрабатываемых кадров
+        return max(2, round(self.window_len * self.window_scale))
+
+    @staticmethod
+    def find_last_peak(max_peaks: Sequence[int],
+                       min_peaks: Sequence[int]) -> tuple:
+        """
+        Возвращает последний всплеск из переданных значений
+        :param max_peaks: Все верхние экстремумы по возрастанию
+        :param min_peaks: Все нижние экстремумы по возрастанию
+        :return: [[max_peak1, max_peak2], [min_peak]]. Если перед
+        последним максимумом нет минимума, а перед ним максимума, то
+        пустые списки
+        """
+        f = max_peaks[-1]
+        num = bisect_left(min_peaks, f) - 1
+        if num < 0:
+            return [], []
+        m = min_peaks[num]
+        num = bisect_left(max_peaks, m) - 1
+        if num < 0:
+            return [], []
+        return [max_peaks[num], f], [m]
+
+    @classmethod
+    def find_peaks(cls, array: np.ndarray) -> List[List[int]]:
+        # Находим экстремумы по смене знака приращений
+        steps = np.diff(np.sign(np.diff(array)))
+        return cls.split_peaks(steps[np.newaxis])[0]
+
+    @staticmethod
+    def split_peaks(steps: np.ndarray) -> List[List[List[int]]]:
+        """
+        Экстремумы нескольких кривых одним проходом по массиву
+        :param steps: Изменения знака приращений, кривые по строкам
+        :return: [все экстремумы, максимумы, минимумы] для каждой кривой
+        """
+        rows, cols = np.nonzero(steps)
+        kinds = steps[rows, cols]
+        result = [[[], [], []] for _ in range(steps.shape[0])]
+        # Экстремумов в срезе единицы, поэтому раскладываем их в цикле
+        for row, col, kind in zip(rows.tolist(), (cols + 1).tolist(),
+                                  kinds.tolist()):
+            peaks = result[row]
+            peaks[0].append(col)
+            peaks[1 if kind < 0 else 2].append(col)
+        return result
+
+    @staticmethod
+    def create_data(time: float, deltas: list, is_y1_top: bool,
+                    peaks: list) -> dict:
+        """
+        :param peaks: Координаты (y, x) вершин: массивы максимумов (2, 2)
+        и минимумы (2,) первой и второй прямой
+        """
+        d1, d2 = deltas
+        max_p1, min_p1, max_p2, min_p2 = peaks
+        upper, lower = (max_p1, min_p1, d1), (max_p2, min_p2, d2)
+        if not is_y1_top:
+            upper, lower = lower, upper
+        # Проебразуем данные о всплеске
+        data = {
+            'time': round(time, 2),
+            'upper': {
+                'delta': upper[2],
+                'max': upper[0][:, Y].tolist(),
+                'min': int(upper[1][Y])
+            }, 'lower': {
+                'delta': lower[2],
+                'max': lower[0][:, Y].tolist(),
+                'min': int(lower[1][Y])
+            }
+        }
+        return data
+
+    def trim_detected_peaks(self) -> None:
+        # Оставляем только последние обнаруженные пики
+        self.detected_peaks = self.detected_peaks[-self.leave_det_peaks:]
+
+    def find_all(self, data: Samples, interval: float = 0.1,
+                 max_chunks: int = 300) -> np.ndarray:
+        """
+        Все вдохи записи, которые распознал бы анализатор, проверяя срез
+        за последние tm_delta мс раз в interval секунд. Знаки приращений
+        сглаженных прямых считаются один раз на всю запись, а экстремумы
+        каждого среза получаются из точек смены знака двоичным поиском,
+        как в SignRuns.peaks. Отдельно анализируются только срезы не
+        длиннее окна сглаживания и срезы с нулевыми Y. Состояние детектора, в
+        том числе detected_peaks, не меняется
+        :param data: Samples или массив строк (time, y1, y2, x1, x2)
+        :param interval: Период анализа (с)
+        :param max_chunks: Количество записей в окне данных анализатора
+        :return: Номера записей вершин (вдохов, 6) в формате select_peaks
+        """
+        if not isinstance(data, Samples):
+            data = Samples.from_rows(np.asarray(data))
+        if not data.times.shape[0]:
+            return np.zeros((0, 6), np.int64)
+        starts, ends = tick_windows(data.times, interval,
+                                    self.tm_delta / 1000, max_chunks).T
+        last = ends - 1
+
+        m1, m2 = self.markers
+        coords = data.coords[:, [m1, m2]]
+        lines = coords[:, :, Y].T.astype(np.int32)
+        w = self.smooth_window()
+
+        # Проверки prepare для всех срезов сразу по номерам последних
+        # неподходящих записей, как в StreamingBreathDetector
+        nonzero = (last_true(coords.any(axis=2).T)[:, last] >=
+                   starts).all(0)
+        x1, x2 = coords[:, 0, X], coords[:, 1, X]
+        ordered = (last_true(x1 <= x2)[last] < starts) | \
+            (last_true(x2 <= x1)[last] < starts)
+        single = (ends - starts <= w) | \
+            (last_true(lines == 0)[:, last].max(0) >= starts)
+        ticks = np.flatnonzero(~single & nonzero & ordered)
+
+        found = np.zeros((6, 0), np.int64)
+        if ticks.shape[0]:
+            signs = [smooth_signs(i, w) for i in lines]
+            g0 = starts[ticks] + w // 2
+            g1 = ends[ticks] - 2 - (w - 1) // 2
+            ok1, peaks1 = self.select_windows(signs[0], w, g0, g1)
+            ok2, peaks2 = self.select_windows(signs[1], w, g0, g1)
+            ok = ok1 & ok2
+            found = np.concatenate([peaks1[:, ok], peaks2[:, ok]])
+            ticks = ticks[ok]
+
+        # Короткие срезы и срезы с нулями - как в анализаторе, целиком.
+        # У срезов длиной в окно нет приращений, не задетых краями
+        rows, nums = [], []
+        for num in np.flatnonzero(single).tolist():
+            start = int(starts[num])
+            peaks = self.prepare(data.slice(start, int(ends[num])))
+            idx = None if peaks is None else self.select_peaks(*peaks)
+            if idx is not None:
+                rows.append([i + start for i in idx])
+                nums.append(num)
+        if rows:
+            found = np.concatenate([found, np.array(rows, np.int64).T], 1)
+            ticks = np.concatenate([ticks, nums])
+        order = np.argsort(ticks, kind='stable')
+        found, ticks = found[:, order].T, ticks[order]
+
+        # Проверка дельт всех всплесков
+        _, deltas, is_y1_top = self.measure_breaths(data, found)
+        limits = np.array([self.delta_bot, self.delta_top])
+        normal1, normal2 = limits[is_y1_top * 1], limits[1 - is_y1_top]
+        passed = np.flatnonzero(
+            (normal1[:, 0] <= deltas[:, 0]) & (deltas[:, 0] <= normal1[:, 1]) &
+            (normal2[:, 0] <= deltas[:, 1]) & (deltas[:, 1] <= normal2[:, 1]))
+
+        # Повторно обнаруженные всплески отбрасываются по порядку срезов,
+        # как в analyse_peaks. Список пиков обрезается, когда кольцо
+        # массива проходит полный круг
+        laps = ends[ticks[passed]] // ring_size(max_chunks)
+        times = data.times[found[passed][:, [2, 5]]]
+        # Всплеск виден в нескольких срезах подряд. Повтор в том же круге
+        # кольца всегда отбрасывается, поэтому в цикл попадает только
+        # первый срез
+        first = np.ones(passed.shape[0], bool)
+        first[1:] = (times[1:] != times[:-1]).any(1) | (laps[1:] != laps[:-1])
+        detected: List[float] = []
+        lap, result = 0, []
+        for num, tick_lap, (p1_time, p2_time) in zip(
+                passed[first].tolist(), laps[first].tolist(),
+                times[first].tolist()):
+            if tick_lap > lap:
+                detected = detected[-self.leave_det_peaks:]
+                lap = tick_lap
+            if p1_time not in detected and p2_time not in detected:
+                detected.extend([p1_time, p2_time])
+                result.append(num)
+        return found[result]
+
+    def detect_all(self, data: Samples, interval: float = 0.1,
+                   max_chunks: int = 300) -> List[Dict[str, Any]]:
+        """
+        Все вдохи записи в формате create_data. Параметры как у find_all
+        """
+        if not isinstance(data, Samples):
+            data = Samples.from_rows(np.asarray(data))
+        idx = self.find_all(data, interval, max_chunks)
+        points, deltas, is_y1_top = self.measure_breaths(data, idx)
+        times = data.times[idx[:, 2]].tolist()
+        return [self.create_data(time, delta, top,
+                                 [p[0:2], p[2], p[3:5], p[5]])
+                for time, delta, top, p in zip(times, deltas.tolist(),
+                                               is_y1_top.tolist(), points)]
+
+    def measure_breaths(self, data: Samples, idx: np.ndarray) -> tuple:
+        """
+        Координаты вершин и дельты нескольких всплесков, как в
+        analyse_peaks
+        :param idx: Номера вершин (всплесков, 6)
+        :return: (координаты (y, x) вершин, дельты обеих прямых,
+        находится ли первая прямая сверху)
+        """
+        # Минимум второй прямой берется с первой прямой, как в analyse_peaks
+        m1, m2 = self.markers
+        points = data.coords[idx, [m1, m1, m1, m2, m2, m1]]
+        ys = points[:, :, Y].astype(np.int64)
+        deltas = np.stack([(ys[:, 0] + ys[:, 1]) // 2 - ys[:, 2],
+                           (ys[:, 3] + ys[:, 4]) // 2 - ys[:, 5]], 1)
+        return points, deltas, points[:, 2, X] < points[:, 5, X]
+
+    @staticmethod
+    def select_windows(signs: np.ndarray, window_len: int, g0: np.ndarray,
+                       g1: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        select_peaks для одной прямой во всех срезах сразу. Экстремумы
+        среза - смены знака внутри (g0, g1] и края, как в SignRuns.peaks
+        :param signs: Знаки приращений прямой по всей записи
+        :param window_len: Окно сглаживания
+        :param g0: Первые приращения срезов, не задетые краями
+        :param g1: Последние приращения срезов, не задетые краями, не
+        раньше g0
+        :return: Выбран ли всплеск в каждом срезе и номера его вершин
+        (max, max, min)
+        """
+        # Номер точки первого знака
+        offset = window_len // 2
+        change = np.flatnonzero(signs[1:] != signs[:-1]) + 1
+        new, prev = signs[change], signs[change - 1]
+        # Заглушка в конце, чтобы номера после последней смены знака
+        # оставались в пределах массива
+        end = np.iinfo(np.int64).max
+        maxs = np.append(change[new < prev] + offset, end)
+        mins = np.append(change[new > prev] + offset, end)
+
+        # Края среза. При окне 2 правого края нет
+        head = signs[g0 - offset] != 1
+        tail = (window_len > 2) & (signs[g1 - offset] != -1)
+        lo_max = np.searchsorted(maxs, g0, side='right')
+        hi_max = np.searchsorted(maxs, g1, side='right')
+        lo_min = np.searchsorted(mins, g0, side='right')
+        hi_min = np.searchsorted(mins, g1, side='right')
+        n_max = head + (hi_max - lo_max) + tail
+        n_min = hi_min - lo_min
+
+        # Ровно два максимума и минимум
+        exact = (n_max == 2) & (n_min == 1)
+        first = np.where(head, g0, maxs.take(lo_max, mode='clip'))
+        second = np.where(tail, g1 + 1,
+                          maxs.take(lo_max + ~head, mode='clip'))
+
+        # Последний всплеск, как в find_last_peak
+        f = np.where(tail, g1 + 1, maxs.take(hi_max - 1, mode='clip'))
+        num_min = np.searchsorted(mins, f, side='left') - 1
+        m = mins.take(num_min, mode='clip')
+        num_max = np.searchsorted(maxs, m, side='left') - 1
+        inner = num_max >= lo_max
+        s = np.where(inner, maxs.take(num_max, mode='clip'), g0)
+        many = (n_max > 2) & (n_min > 1) & (num_min >= lo_min) & \
+            (inner | head)
+
+        peaks = np.where(exact, [first, second,
+                                 mins.take(lo_min, mode='clip')],
+                         [s, f, m])
+        return exact | many, peaks
+
+
+class SignRuns:
+    """
+    Знаки приращений сглаженной кривой одной метки и точки их смены.
+    Значения np.convolve там, где окно сглаживания целиком лежит внутри
+    кривой, не зависят от среза, поэтому знаки новых записей считаются
+    одним np.convolve по ним и последним window_len - 1 значениям и
+    совпадают со знаками smooth_line. Время на запись не зависит от
+    длины среза. Точки смены знака - экстремумы кривой, как в find_peaks
+    """
+
+    def __init__(self, window_len: int, batch: int = 1024) -> None:
+        """
+        :param window_len: Окно сглаживания
+        :param batch: Сколько записей можно накопить до подсчета знаков
+        """
+        self.window_len: int = window_len
+        self.batch: int = batch
+        self.kernel: np.ndarray = smooth_kernel(window_len)
+
+        # Последние window_len - 1 значений с посчитанными знаками и
+        # значения, ожидающие подсчета
+        self.values: List[int] = []
+        self.pending: List[int] = []
+        # Сглаженное значение последней точки с полным окном
+        self.smooth: Optional[float] = None
+        # Количество поступивших значений
+        self.count: int = 0
+
+        # Первая точка с известным знаком и ее знак
+        self.start: Optional[int] = None
+        self.start_sign: int = 0
+        # Знак последнего приращения
+        self.sign: Optional[int] = None
+
+        # Точки смены знака и новые знаки
+        self.pos: List[int] = []
+        self.signs: List[int] = []
+        # Те же точки, разделенные на максимумы и минимумы
+        self.maxs: List[int] = []
+        self.mins: List[int] = []
+
+    @classmethod
+    def load(cls, values: np.ndarray, end: int,
+             window_len: int) -> 'SignRuns':
+        """
+        Состояние по последним значениям кривой
+        :param values: Значения кривой, не меньше window_len
+        :param end: Номер записи после последнего значения
+        """
+        runs = cls(window_len)
+        runs.pending = values.tolist()
+        runs.count = end
+        runs.update()
+        return runs
+
+    def push(self, value: int) -> None:
+        self.pending.append(value)
+        self.count += 1
+        if len(self.pending) >= self.batch:
+            self.update()
+
+    def update(self) -> None:
+        # Знаки приращений для накопленных значений
+        if not self.pending:
+            return
+        w = self.window_len
+        values = self.values + self.pending
+        self.values, self.pending = values[1 - w:], []
+        smooth = np.convolve(values, self.kernel, 'valid').tolist()
+
+        # Последнее значение окна дает приращение в точке
+        # g = j - (w + 1) // 2, где j - номер этого значения
+        g = self.count - len(smooth) - (w + 1) // 2
+        for value in smooth:
+            prev, self.smooth = self.smooth, value
+            if prev is not None:
+                self.add_sign((value > prev) - (value < prev), g)
+            g += 1
+
+    def add_sign(self, sign: int, g: int) -> None:
+        # Знак приращения в точке g
+        if self.sign is None:
+            self.start, self.start_sign = g, sign
+        elif sign != self.sign:
+            self.pos.append(g)
+            self.signs.append(sign)
+            (self.maxs if sign < self.sign else self.mins).append(g)
+        self.sign = sign
+
+    def covers(self, g: int) -> bool:
+        # Известны ли знаки начиная с точки g
+        return self.start is not None and self.start <= g
+
+    def sign_at(self, g: int) -> int:
+        num = bisect_right(self.pos, g) - 1
+        return self.signs[num] if num >= 0 else self.start_sign
+
+    def prune(self, g: int) -> None:
+        # Забываем смены знака до точки g, сохраняя знак в ней
+        num = bisect_right(self.pos, g) - 1
+        if num < 0:
+            return
+        self.start, self.start_sign = self.pos[num], self.signs[num]
+        del self.pos[:num + 1], self.signs[:num + 1]
+        del self.maxs[:bisect_right(self.maxs, g)]
+        del self.mins[:bisect_right(self.mins, g)]
+
+    def peaks(self, start: int, end: int) -> List[List[int]]:
+        """
+        Экстремумы сглаженной кривой среза [start, end) в формате
+        find_peaks, с номерами внутри среза. Внутри среза знаки
+        приращений совпадают с известными, кроме краев: np.convolve
+        дополняет срез нулями, поэтому первые window_len // 2
+        приращений положительные, а последние (window_len - 1) // 2
+        отрицательные, если значения на краях не нулевые
+        """
+        w = self.window_len
+        # Первое и последнее приращение, не задетые краями. При окне 2
+        # правого края нет
+        g0, g1 = start + w // 2, end - 2 - (w - 1) // 2
+        tail = w > 2
+        maxs, mins = [], []
+        if g1 < g0:
+            # Срез длиной в окно: подъем сразу сменяется спуском
+            if tail:
+                maxs.append(g0)
+        else:
+            if self.sign_at(g0) != 1:
+                maxs.append(g0)
+            maxs.extend(self.maxs[bisect_right(self.maxs, g0):
+                                  bisect_right(self.maxs, g1)])
+            mins.extend(self.mins[bisect_right(self.mins, g0):
+                                  bisect_right(self.mins, g1)])
+            if tail and self.sign != -1:
+                maxs.append(g1 + 1)
+
+        maxs = [i - start for i in maxs]
+        mins = [i - start for i in mins]
+        return [sorted(maxs + mins), maxs, mins]
+
+
+class StreamingBreathDetector(BreathDetector):
+    """
+    Распознавание вдоха с потоковым сглаживанием и поиском экстремумов.
+    Записи передаются в push_sample по мере поступления, и время на
+    каждую не зависит от длины среза. При анализе среза заново считаются
+    только края среза, а результат совпадает с BreathDetector.detect.
+    Если потоковое состояние не подходит к срезу (короткий срез, нули
+    в координатах, смена окна сглаживания), срез анализируется целиком
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        # Количество переданных записей
+        self.count: int = 0
+        # Знаки приращений обеих кривых. Создаются по первому подходящему
+        # срезу и пересоздаются при смене окна сглаживания
+        self.runs: Optional[List[SignRuns]] = None
+
+        # Номера последних записей, не проходящих проверки среза: обе
+        # координаты метки не равны 0, Y не равен 0, первая метка левее
+        # второй и наоборот
+        self._last_nonzero: List[int] = [-1, -1]
+        self._last_zero_y: List[int] = [-1, -1]
+        self._last_not_before: int = -1
+        self._last_not_after: int = -1
+
+    def push_sample(self, coords: np.ndarray) -> None:
+        """
+        Новая запись
+        :param coords: Координаты меток записи [метка, (y, x)]
+        """
+        j = self.count
+        self.count += 1
+        (y1, x1), (y2, x2) = coords[list(self.markers)].tolist()
+
+        if y1 or x1:
+            self._last_nonzero[0] = j
+        if y2 or x2:
+            self._last_nonzero[1] = j
+        if not y1:
+            self._last_zero_y[0] = j
+        if not y2:
+            self._last_zero_y[1] = j
+        if x1 <= x2:
+            self._last_not_before = j
+        if x2 <= x1:
+            self._last_not_after = j
+
+        runs = self.runs
+        if runs is not None:
+            if runs[0].window_len == self.smooth_window():
+                runs[0].push(y1)
+                runs[1].push(y2)
+            else:
+                self.runs = None
+
+    def detect(self, data: Samples) -> Optional[Dict[str, Any]]:
+        """
+        Анализ последних записей
+        :param data: Срез последних переданных записей
+        :return: Данные о вдохе или None
+        """
+        n = data.times.shape[0]
+        w = self.smooth_window()
+        start, end = self.count - n, self.count
+        if n < w or start < 0 or max(self._last_zero_y) >= start:
+            return super().detect(data)
+
+        # Те же проверки, что в prepare, по номерам последних
+        # неподходящих записей
+        if min(self._last_nonzero) < start:
+            return None
+        if self._last_not_before >= start and \
+                self._last_not_after >= start:
+            return None
+
+        g0 = start + w // 2
+        runs = self.runs
+        if runs is not None:
+            for i in runs:
+                i.update()
+        if runs is None or runs[0].window_len != w or \
+                (n > w and not all(i.covers(g0) for i in runs)):
+            lines = data.coords[:, self.markers, Y].astype(np.int64)
+            self.runs = runs = [SignRuns.load(lines[:, i], end, w)
+                                for i in range(2)]
+        for i in runs:
+            i.prune(g0)
+
+        return self.analyse_peaks(runs[0].peaks(start, end),
+                                  runs[1].peaks(start, end), data)
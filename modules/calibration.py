@@ -0,0 +1,65 @@
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+
+class HsvHistogram:
+    """
+    Трехмерная гистограмма HSV остановленного кадра с накопленными суммами.
+    Количество пикселей в любом диапазоне HSV считается за 8 обращений к
+    таблице сумм, без повторного прохода по кадру. S и V разбиты на
+    корзины по 4 значения, поэтому на границах корзин количество
+    приблизительное
+    """
+
+    def __init__(self, hsv: np.ndarray, bins: Tuple[int, int, int] =
+                 (180, 64, 64)) -> None:
+        # Кадр в HSV. Переводится один раз при остановке кадра
+        self.hsv: np.ndarray = hsv
+        self.total: int = hsv.shape[0] * hsv.shape[1]
+
+        self.bins = bins
+        self.steps = (180 / bins[0], 256 / bins[1], 256 / bins[2])
+
+        hist = cv2.calcHist([hsv], [0, 1, 2], None, list(bins),
+                            [0, 180, 0, 256, 0, 256]).astype(np.int64)
+
+        # Накопленные суммы с нулевым слоем по каждой оси
+        self.sums = np.zeros([i + 1 for i in bins], np.int64)
+        self.sums[1:, 1:, 1:] = hist.cumsum(0).cumsum(1).cumsum(2)
+
+    def count(self, hsv_min: List[int], hsv_max: List[int]) -> int:
+        """
+        Количество пикселей кадра в диапазоне [hsv_min, hsv_max]
+        """
+        lo, hi = [], []
+        for n in range(3):
+            lo.append(min(int(hsv_min[n] // self.steps[n]), self.bins[n]))
+            hi.append(min(int(hsv_max[n] // self.steps[n]) + 1, self.bins[n]))
+            if hi[n] <= lo[n]:
+                return 0
+
+        s = self.sums
+        (h0, s0, v0), (h1, s1, v1) = lo, hi
+        return int(s[h1, s1, v1] - s[h0, s1, v1] - s[h1, s0, v1] -
+                   s[h1, s1, v0] + s[h0, s0, v1] + s[h0, s1, v0] +
+                   s[h1, s0, v0] - s[h0, s0, v0])
+
+    def mask(self, hsv_min: np.ndarray, hsv_max: np.ndarray) -> np.ndarray:
+        # Маска по уже переведенному в HSV кадру
+        return cv2.inRange(self.hsv, hsv_min, hsv_max)
+
+
+def propose_range(hsv: np.ndarray, low: float = 2,
+                  high: float = 98) -> List[List[int]]:
+    """
+    Диапазон цвета по выделенной области
+    :param hsv: HSV пиксели выделенной области
+    :param low: Нижний перцентиль каждого канала
+    :param high: Верхний перцентиль каждого канала
+    :return: [hsv_min, hsv_max]
+    """
+    pixels = hsv.reshape(-1, 3)
+    return [np.percentile(pixels, low, axis=0).astype(int).tolist(),
+            np.ceil(np.percentile(pixels, high, axis=0)).astype(int).tolist()]
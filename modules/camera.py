@@ -0,0 +1,289 @@
+import glob
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Union
+
+import cv2
+
+from modules.frame_hub import FrameHub, FrameSubscriber
+from modules.tools import abspath
+
+
+class Camera:
+    # Кадры идут в реальном времени, и их можно пропускать. Записи без
+    # realtime обрабатываются целиком
+    realtime: bool = True
+
+    def __init__(self, name='Threading-Camera', device: int = 0,
+                 width: int = 320, height: int = 240, fps: float = 25):
+        self.name = name
+        self.device = device
+
+        # Запрашиваемые у камеры разрешение и частота кадров
+        self.width, self.height = width, height
+        self.fps = fps
+        self.cap = self.last_frame = self.ret = None
+        self.is_restarted = False
+
+        # Доля от запрашиваемого разрешения. Меняется регулятором качества
+        # и применяется в потоке камеры перед следующим чтением
+        self.scale: float = 1
+        self._rescale = False
+
+        # Кольцевой буфер, через который кадры раздаются подписчикам
+        self.hub = FrameHub()
+
+        self._thread = None
+
+        self.connect_to_device()
+        self._open_thread()
+
+    def _open_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self.run, name=self.name)
+            self._thread.start()
+
+    def _close_thread(self):
+        self._thread.do_run = False
+        self._thread.join()
+
+    def _restart_thread(self):
+        self._close_thread()
+        self._open_thread()
+
+    def disconnect_camera(self):
+        # Сначала закрываем буфер, чтобы поток камеры не ждал подписчиков
+        self.hub.close()
+        self._close_thread()
+        self.release()
+
+    def connect_to_device(self):
+        self.cap = cv2.VideoCapture(self.device)
+
+        self.apply_resolution()
+        self.cap.set(cv2.CAP_PROP_FPS, self.fps)
+
+    def apply_resolution(self):
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, int(self.width * self.scale))
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, int(self.height * self.scale))
+
+    def set_scale(self, scale: float):
+        # Изменение разрешения съемки. Для записей не действует
+        if scale != self.scale:
+            self.scale = scale
+            self._rescale = True
+
+    def read(self):
+        frame = self.hub.latest()
+        if frame is None:
+            return self.ret, None
+        return self.ret, frame.image
+
+    def subscribe(self, policy: str = FrameSubscriber.LATEST,
+                  maxsize: int = 1, block: bool = False) -> FrameSubscriber:
+        return self.hub.subscribe(policy, maxsize, block)
+
+    def isOpened(self):
+        return self.cap.isOpened() or self.is_restarted
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+
+    def restart(self):
+        if not self.is_restarted:
+            self.is_restarted = True
+            self.disconnect_camera()
+            self.connect_to_device()
+            self.hub.open()
+            self._restart_thread()
+            self.is_restarted = False
+
+    def run(self):
+        t = threading.currentThread()
+        while getattr(t, "do_run", True) and self.isOpened():
+            if self._rescale:
+                self._rescale = False
+                self.apply_resolution()
+                self.last_frame = None
+
+            self.ret, self.last_frame = self.cap.read(self.last_frame)
+            if not self.ret:
+                # Не крутим цикл вхолостую, пока камера не отдает кадры
+                time.sleep(0.01)
+                continue
+            # Раздаем кадр всем подписчикам
+            self.hub.publish(self.last_frame, time.time())
+        self.hub.close()
+
+
+class ImageSequenceCapture:
+    """
+    Источник кадров из набора изображений PNG/JPEG с интерфейсом,
+    совпадающим с cv2.VideoCapture
+    """
+    EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+    def __init__(self, source: str):
+        # Источник - папка с изображениями или glob-шаблон
+        if os.path.isdir(source):
+            self.files = sorted(os.path.join(source, f)
+                                for f in os.listdir(source)
+                                if f.lower().endswith(self.EXTENSIONS))
+        else:
+            self.files = sorted(glob.glob(source))
+
+        self.pos = 0
+        self.opened = bool(self.files)
+        self.props = {}
+
+    def read(self, image=None):
+        if not self.opened or self.pos >= len(self.files):
+            return False, image
+
+        frame = cv2.imread(self.files[self.pos])
+        self.pos += 1
+        if frame is None:
+            return False, image
+        return True, frame
+
+    def isOpened(self):
+        return self.opened
+
+    def release(self):
+        self.opened = False
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.pos
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.files)
+        return self.props.get(prop, 0)
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.pos = int(value)
+        else:
+            self.props[prop] = value
+        return True
+
+
+class FileCamera(Camera):
+    """
+    Камера, воспроизводящая записанное видео или набор изображений.
+    В режиме realtime кадры отдаются с частотой записи, иначе - с
+    максимально возможной скоростью. Без realtime время кадра - время
+    начала воспроизведения плюс номер кадра в записи, деленный на
+    частоту, поэтому интервалы между кадрами не зависят от скорости
+    компьютера, а задержки обработки теряют смысл. Блокирующие
+    подписчики притормаживают воспроизведение, и кадры не теряются
+    """
+
+    def __init__(self, source: str, realtime: bool = True, loop: bool = False,
+                 fps: float = 25, name='File-Camera'):
+        self.source = source
+        self.realtime = realtime
+        self.loop = loop
+
+        # Частота кадров по умолчанию, если ее нет в самом файле
+        self.frame_interval = 1 / fps
+
+        # Флаг окончания записи
+        self.finished = False
+
+        super().__init__(name, fps=fps)
+
+    def connect_to_device(self):
+        if os.path.isdir(self.source) or glob.has_magic(self.source):
+            self.cap = ImageSequenceCapture(self.source)
+        else:
+            self.cap = cv2.VideoCapture(self.source)
+
+        src_fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frame_interval = 1 / (src_fps if src_fps > 0 else self.fps)
+        self.finished = False
+
+    def isOpened(self):
+        return (self.cap.isOpened() and not self.finished) or \
+            self.is_restarted
+
+    def rewind(self) -> bool:
+        return self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def run(self):
+        t = threading.currentThread()
+        next_time = time.perf_counter()
+        # Время начала воспроизведения и номер кадра от начала. При
+        # повторе записи номер не сбрасывается, чтобы время не шло назад
+        if not self.realtime:
+            # Запись обрабатывается целиком - ждем первого подписчика
+            self.hub.wait_subscribed()
+        start_time, num = time.time(), 0
+        while getattr(t, "do_run", True) and self.isOpened():
+            self.ret, self.last_frame = self.cap.read(self.last_frame)
+            if not self.ret:
+                # Запись закончилась - начинаем сначала или завершаем работу
+                if self.loop and self.rewind():
+                    continue
+                self.finished = True
+                break
+
+            if self.realtime:
+                # Выдерживаем паузу между кадрами, как при живой съемке
+                next_time += self.frame_interval
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -self.frame_interval:
+                    # Сильно отстали - не пытаемся догнать пропущенное
+                    next_time = time.perf_counter()
+                timestamp = time.time()
+            else:
+                # Время кадра в записи
+                timestamp = start_time + num * self.frame_interval
+            num += 1
+
+            self.hub.publish(self.last_frame, timestamp)
+        self.hub.close()
+
+
+def load_camera_settings() -> List[Dict[str, Any]]:
+    """
+    Загружает настройки источников кадров из camera_settings.json.
+    Несколько камер задаются списком cameras, иначе файл описывает одну
+    камеру
+    """
+    try:
+        with open(abspath('data/settings/camera_settings.json'),
+                  encoding='utf-8') as file:
+            dct = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        dct = {}
+    return dct.get('cameras') or [dct]
+
+
+def create_camera(dct: Dict[str, Any] = None,
+                  name: str = 'Threading-Camera') -> Union[Camera, FileCamera]:
+    """
+    Создает источник кадров по настройкам.
+    source - номер устройства или путь к видеофайлу / папке / glob-шаблону
+    с изображениями. width, height, fps - параметры съемки камеры
+    """
+    if dct is None:
+        dct = load_camera_settings()[0]
+
+    source = dct.get('source', 0)
+    if isinstance(source, int):
+        return Camera(name, device=source, width=dct.get('width', 320),
+                      height=dct.get('height', 240), fps=dct.get('fps', 25))
+    return FileCamera(source, realtime=dct.get('realtime', True),
+                      loop=dct.get('loop', False), fps=dct.get('fps', 25),
+                      name=name)
+
+
+def create_cameras() -> List[Union[Camera, FileCamera]]:
+    # Создает все камеры из настроек
+    return [create_camera(dct, name=f'Threading-Camera-{num}')
+            for num, dct in enumerate(load_camera_settings())]
@@ -1,71 +1,21 @@
-import threading
+import time
+from typing import Dict, Optional, Tuple
 
 import cv2
 import numpy as np
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtGui import QImage
 from PyQt5.QtWidgets import QLabel
 
 from data.settings.settings import *
-
-
-class Camera:
-    def __init__(self, name='Threading-Camera'):
-        self.name = name
-        self.cap = self.last_frame = self.ret = None
-        self.is_restarted = False
-
-        self._thread = None
-
-        self.connect_to_device()
-        self._open_thread()
-
-    def _open_thread(self):
-        if self._thread is None or not self._thread.is_alive():
-            self._thread = threading.Thread(target=self.run, name=self.name)
-            self._thread.start()
-
-    def _close_thread(self):
-        self._thread.do_run = False
-        self._thread.join()
-
-    def _restart_thread(self):
-        self._close_thread()
-        self._open_thread()
-
-    def disconnect_camera(self):
-        self._close_thread()
-        self.release()
-
-    def connect_to_device(self):
-        self.cap = cv2.VideoCapture(0)
-
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 320)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 240)
-        self.cap.set(cv2.CAP_PROP_FPS, 25)
-
-    def read(self):
-        return self.ret, self.last_frame
-
-    def isOpened(self):
-        return self.cap.isOpened() or self.is_restarted
-
-    def release(self):
-        if self.cap is not None:
-            self.cap.release()
-
-    def restart(self):
-        if not self.is_restarted:
-            self.is_restarted = True
-            self.disconnect_camera()
-            self.connect_to_device()
-            self._restart_thread()
-            self.is_restarted = False
-
-    def run(self):
-        t = threading.currentThread()
-        while getattr(t, "do_run", True) and self.isOpened():
-            self.ret, self.last_frame = self.cap.read()
+from modules.calibration import HsvHistogram
+from modules.camera import Camera
+from modules.detection import create_detector, load_detection_settings
+from modules.detection_process import DetectionProcess
+from modules.frame_hub import Frame, FrameSubscriber
+from modules.governor import QualityLevel, create_governor
+from modules.pipeline import PipelineStats
+from modules.tracing import tracer
 
 
 class WindowCamera(QThread):
@@ -82,95 +32,294 @@ class WindowCamera(QThread):
         # Подключаем камеру
         self.cam = camera
 
+        # Подписка на кадры камеры. Создается при запуске потока
+        self.frames: FrameSubscriber = None
+        # Последний полученный кадр с номером и временем захвата
+        self.frame: Frame = None
+
+        # Два буфера картинки под размер лэйбла. Пока интерфейс не забрал
+        # картинку из одного буфера, новая картинка не рисуется, поэтому
+        # второй буфер можно перезаписывать без копирования в QImage
+        self._preview_bufs = [None, None]
+        self._preview_idx: int = 0
+        self._preview_pending: bool = False
+        self.changePixmap.connect(self.preview_shown)
+
     def release(self) -> None:
         self.cam.release()
 
     def stop(self):
         self.is_run = False
+        # Блокирующий подписчик больше не должен задерживать камеру
+        if self.frames is not None:
+            self.frames.close()
 
     def start(self, *args):
         self.is_run = True
+        self.frames = self.subscribe()
         super().start()
 
+    def subscribe(self) -> FrameSubscriber:
+        return self.cam.subscribe()
+
+    def next_frame(self, timeout: float = 0.5):
+        # Ожидаем новый кадр, не нагружая процессор повторной обработкой
+        frame = self.frames.get(timeout)
+        if frame is None:
+            return False, None
+        self.frame = frame
+        return True, frame.image
+
     def restart(self):
         self.stop()
         self.start()
 
+    def preview_visible(self) -> bool:
+        return self.label.isVisible() and \
+            not self.label.window().isMinimized()
+
+    def preview_shown(self) -> None:
+        self._preview_pending = False
+
+    def emit_image(self, img: np.ndarray) -> None:
+        """
+        Передает кадр в интерфейс. Кадр один раз уменьшается в буфер под
+        размер лэйбла и оборачивается в QImage без перевода в RGB
+        :param img: BGR кадр или одноканальная маска
+        """
+        # Из потока интерфейса (остановленный кадр) рисуем всегда
+        if self._preview_pending and QThread.currentThread() is self or \
+                not self.preview_visible():
+            return
+
+        # Размер картинки с сохранением пропорций кадра
+        h, w = img.shape[:2]
+        k = min(self.label.width() / w, self.label.height() / h)
+        size = (max(1, int(w * k)), max(1, int(h * k)))
+        shape = (size[1], size[0]) + img.shape[2:]
+
+        self._preview_idx ^= 1
+        buf = self._preview_bufs[self._preview_idx]
+        if buf is None or buf.shape != shape:
+            buf = self._preview_bufs[self._preview_idx] = \
+                np.empty(shape, np.uint8)
+        cv2.resize(img, size, dst=buf, interpolation=cv2.INTER_AREA
+                   if k < 1 else cv2.INTER_LINEAR)
+
+        fmt = QImage.Format_BGR888 if buf.ndim == 3 else \
+            QImage.Format_Grayscale8
+        self._preview_pending = True
+        self.changePixmap.emit(QImage(buf.data, size[0], size[1],
+                                      buf.strides[0], fmt))
+
 
 class MainWindowCamera(WindowCamera):
-    def __init__(self, label: QLabel, camera):
+    def __init__(self, label: QLabel, camera, analyzer=None):
         super().__init__(label, camera)
 
+        # Анализатор, в который передаются координаты меток
+        self.analyzer = analyzer
+        if analyzer is not None:
+            analyzer.realtime = camera.realtime
+
+        self.settings = load_detection_settings()
+
+        # Распознавание меток
+        self.detector = create_detector(self.settings)
+
+        # Распознавание в отдельном процессе через разделяемую память
+        self.use_process: bool = self.settings.get('use_process', False)
+        self.process_slots: int = self.settings.get('process_slots', 3)
+        self.worker: DetectionProcess = None
+
+        # Частота обновления картинки. Распознавание идет на каждом кадре,
+        # а рисуются только отображаемые кадры. 0 - без картинки
+        self.preview_fps: float = self.settings.get('preview_fps', 15)
+        self.preview_enabled: bool = True
+        self._last_preview: float = 0
+
+        # Частота обработки и загрузка процессора этой камерой
+        self.stats = PipelineStats(interval=2)
+        self.fps: float = 0
+        self.cpu: float = 0
+
+        # Регулятор качества под нагрузкой. None - качество не меняется.
+        # Для записей без realtime задержки не считаются, и регулятор не
+        # нужен
+        self.governor = create_governor(self.settings, camera.name) \
+            if camera.realtime else None
+        # Время захвата последнего обработанного кадра
+        self._last_processed: float = None
+
+    def subscribe(self) -> FrameSubscriber:
+        # Запись без realtime ждет распознавания и не теряет кадры
+        if self.cam.realtime:
+            return self.cam.subscribe()
+        return self.cam.subscribe(FrameSubscriber.QUEUE,
+                                  self.cam.hub.size - 1, block=True)
+
+    @property
+    def current_colors(self) -> dict:
         # Список цветов для распознавния
-        self.current_colors = {}
+        return self.detector.colors
 
     def set_current_colors(self, colors_array: dict) -> None:
         # Формируем новый список цветов для распознавания
-        new_colors = {k: [np.array(v[0], np.uint8),
-                          np.array(v[1], np.uint8)]
-                      for k, v in colors_array.items()}
-        self.current_colors = new_colors
+        self.detector.set_colors(colors_array)
+        if self.worker is not None:
+            self.worker.set_colors(colors_array)
+
+    def open_worker(self, shape: tuple) -> None:
+        # Запускаем процесс распознавания под размер кадров камеры
+        self.close_worker()
+        self.worker = DetectionProcess(shape, slots=self.process_slots,
+                                       settings=self.settings)
+        self.worker.set_colors({k: [v[0].tolist(), v[1].tolist()]
+                                for k, v in self.current_colors.items()})
+        self.worker.set_pyramid(self.detector.pyramid)
+
+    def close_worker(self) -> None:
+        if self.worker is not None:
+            self.worker.close()
+            self.worker = None
 
     def run(self) -> None:
+        if self.use_process:
+            self.run_with_process()
+            return
+
         # Пока камера работает получаем изображение и отображаем его
         while self.cam.isOpened() and self.label and self.is_run:
             # Считывание изображения
-            ret, img = self.cam.read()
-
-            if not ret:
-                break
-
-            # Получаем картикну с отмеченными распознанными объектами
-            img = self.get_img_with_objects(img)
-
-            # Переводим в формат для qt
-            rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            h, w, ch = rgb_img.shape
-            bytes_per_line = ch * w
-            convert_to_qt_format = QImage(rgb_img.data, w, h, bytes_per_line,
-                                          QImage.Format_RGB888)
-            try:
-                # Мастшабируем в соответствии с размерами экрана
-                p = convert_to_qt_format.scaled(
-                    self.label.width(), self.label.height(),
-                    Qt.KeepAspectRatio)
-                # Вызываем событие об обновлении картинки
-                self.changePixmap.emit(p)
-            except Exception:
-                pass
-
-    def get_img_with_objects(self, img: np.ndarray) -> np.ndarray:
-        img = cv2.flip(img, 1)  # отражение кадра вдоль оси Y
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-
-        for name, color in self.current_colors.items():
-            hsv_min, hsv_max = color
-
-            # Распознавание цвета куба
-            thresh = cv2.inRange(hsv, hsv_min, hsv_max)
-
-            moments = cv2.moments(thresh, 1)
-            dM01 = moments['m01']
-            dM10 = moments['m10']
-            dArea = moments['m00']
-
-            # Отрисовка координат куба
-            if dArea > 100:
-                x = int(dM10 / dArea)
-                y = int(dM01 / dArea)
-
-                try:
-                    # Добавляем новые координаты для точки определенного цвета
-                    self.parent().analyzer.add_next_position(name, (x, y))
-                except Exception:
-                    # print('camera_views.py:100 // exp //', e)
-                    pass
-
-                cv2.circle(img, (x, y), circle_radius, yellow_color, 2)
-                cv2.putText(img, f"{x}-{y}", (x + 10, y - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, text_scale,
-                            yellow_color, 2)
-        return img
+            ret, img = self.next_frame()
+
+            if not ret or not self.frame_due():
+                continue
+
+            # Распознаем объекты на исходном кадре
+            positions = self.detector.detect(img, mirror=True)
+            self.add_positions(self.normalize(positions, img),
+                               self.frame.timestamp, self.frame.seq)
+            self.count_frame(time.thread_time())
+            self.govern(self.frame.timestamp)
+
+            # Рисуем картинку, только если ее пора показать
+            if self.preview_due():
+                img = cv2.flip(img, 1)  # отражение кадра вдоль оси Y
+                self.draw_objects(img, positions)
+                self.emit_image(img)
+
+    def run_with_process(self) -> None:
+        while self.cam.isOpened() and self.label and self.is_run:
+            ret, img = self.next_frame()
+
+            if ret and self.frame_due():
+                if self.worker is None or self.worker.shape != img.shape:
+                    self.open_worker(img.shape)
+                # Кадры записи без realtime не пропускаем - ждем свободный
+                # слот процесса распознавания
+                while not self.cam.realtime and self.worker.busy() and \
+                        self.is_run:
+                    self.take_results(0.5)
+                self.worker.submit(img, self.frame.seq, self.frame.timestamp)
+
+            if self.worker is None:
+                continue
+
+            # Забираем готовые результаты. Если все слоты заняты, то ждем
+            # освобождения хотя бы одного
+            self.take_results(0.5 if self.worker.busy() else 0)
+
+    def take_results(self, timeout: float) -> None:
+        # Обрабатываем результаты распознавания, готовые за время ожидания
+        result = self.worker.get(timeout=timeout)
+        while result is not None:
+            idx, seq, timestamp, positions, cpu = result
+
+            self.add_positions(
+                self.normalize(positions, self.worker.frames[idx]),
+                timestamp, seq)
+            self.count_frame(time.thread_time() + cpu)
+            self.govern(timestamp)
+
+            # Отражённый кадр лежит в слоте до его освобождения
+            if self.preview_due():
+                img = self.worker.frames[idx]
+                self.draw_objects(img, positions)
+                self.emit_image(img)
+
+            self.worker.release(idx)
+            result = self.worker.get(timeout=0)
+
+    def frame_due(self) -> bool:
+        # Пропускаем кадры, если регулятор снизил частоту обработки
+        if self.governor is None:
+            return True
+        if not self.governor.frame_due(self.frame.timestamp,
+                                       self._last_processed):
+            return False
+        self._last_processed = self.frame.timestamp
+        return True
+
+    def govern(self, timestamp: float) -> None:
+        # Передаем регулятору задержку обработки кадра
+        if self.governor is None:
+            return
+        level = self.governor.record(timestamp)
+        if level is not None:
+            self.apply_quality(level)
+
+    def normalize(self, positions: Dict[str, Tuple[int, int]],
+                  img: np.ndarray) -> Dict[str, Tuple[int, int]]:
+        if self.governor is None:
+            return positions
+        return self.governor.normalize(positions, img.shape[1])
+
+    def apply_quality(self, level: QualityLevel) -> None:
+        self.detector.pyramid = level.pyramid
+        if self.worker is not None:
+            self.worker.set_pyramid(level.pyramid)
+        self.cam.set_scale(level.scale)
+        if self.analyzer is not None:
+            self.analyzer.window_scale = self.governor.rate_scale
+
+    def count_frame(self, cpu: float) -> None:
+        # Учитываем обработанный кадр в статистике
+        self.stats.frame(cpu)
+        if self.stats.due():
+            self.fps, self.cpu = self.stats.report()[:2]
+
+    def set_preview_enabled(self, flag: bool) -> None:
+        self.preview_enabled = flag
+
+    def preview_due(self) -> bool:
+        # Картинка не нужна, если она выключена или окно свернуто
+        if not self.preview_enabled or self.preview_fps <= 0 or \
+                not self.preview_visible():
+            return False
+
+        now = time.perf_counter()
+        if now - self._last_preview < 1 / self.preview_fps:
+            return False
+        self._last_preview = now
+        return True
+
+    def add_positions(self, positions: Dict[str, Tuple[int, int]],
+                      timestamp: float, trace: int = -1) -> None:
+        # Передаем координаты кадра вместе с временем его захвата и номером
+        if self.cam.realtime:
+            tracer.record('detect', timestamp)
+        if self.analyzer is not None:
+            self.analyzer.push_positions(timestamp, positions, trace)
+
+    @staticmethod
+    def draw_objects(img: np.ndarray,
+                     positions: Dict[str, Tuple[int, int]]) -> None:
+        for x, y in positions.values():
+            cv2.circle(img, (x, y), circle_radius, yellow_color, 2)
+            cv2.putText(img, f"{x}-{y}", (x + 10, y - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, text_scale,
+                        yellow_color, 2)
 
 
 class ColorRangeCamera(WindowCamera):
@@ -180,37 +329,44 @@ class ColorRangeCamera(WindowCamera):
         self.hsv_min = np.array((0, 0, 0), np.uint8)
         self.hsv_max = np.array((255, 255, 255), np.uint8)
 
+        # Гистограмма остановленного кадра. None - показываем живое видео
+        self.histogram: Optional[HsvHistogram] = None
+
+    @property
+    def frozen(self) -> bool:
+        return self.histogram is not None
+
     def set_hmin_hmax(self, hsv_min: list, hsv_max: list) -> None:
         self.hsv_min = np.array(hsv_min, np.uint8)
         self.hsv_max = np.array(hsv_max, np.uint8)
 
+        # На остановленном кадре маску пересчитываем сразу
+        if self.frozen:
+            self.emit_image(self.histogram.mask(self.hsv_min, self.hsv_max))
+
+    def freeze(self) -> bool:
+        # Останавливаем последний кадр и строим по нему гистограмму
+        _, img = self.cam.read()
+        if img is None:
+            return False
+        self.histogram = HsvHistogram(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+        self.emit_image(self.histogram.mask(self.hsv_min, self.hsv_max))
+        return True
+
+    def unfreeze(self) -> None:
+        self.histogram = None
+
     def run(self) -> None:
         # Пока камера работает получаем изображение и отображаем его
         while self.cam.isOpened() and self.label and self.is_run:
             # Считывание изображения
-            ret, img = self.cam.read()
+            ret, img = self.next_frame()
 
-            if not ret:
-                break
+            if not ret or self.frozen:
+                continue
 
             # Преобразование в hsv картинку
             hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
 
             # Выделение нужных цветов на картинке по установленным диапазонам
-            thresh = cv2.inRange(hsv, self.hsv_min, self.hsv_max)
-
-            # Переводим в формат для qt
-            rgb_img = cv2.cvtColor(thresh, cv2.COLOR_BGR2RGB)
-            h, w, ch = rgb_img.shape
-            bytes_per_line = ch * w
-            convert_to_qt_format = QImage(rgb_img.data, w, h, bytes_per_line,
-                                          QImage.Format_RGB888)
-            try:
-                # Мастшабируем в соответствии с размерами экрана
-                p = convert_to_qt_format.scaled(
-                    self.label.width(), self.label.height(),
-                    Qt.KeepAspectRatio)
-                # Вызываем событие об обновлении картинки
-                self.changePixmap.emit(p)
-            except Exception:
-                pass
+            self.emit_image(cv2.inRange(hsv, self.hsv_min, self.hsv_max))
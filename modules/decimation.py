@@ -0,0 +1,213 @@
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Прореженные данные: время начала групп, минимумы и максимумы
+# координат меток в группах
+Decimated = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def decimate(samples: Tuple[np.ndarray, np.ndarray], step: int) -> Decimated:
+    """
+    Минимумы и максимумы групп по step записей
+    :param samples: Время и координаты записей
+    :param step: Количество записей в группе
+    """
+    times, coords = samples
+    if step <= 1 or times.shape[0] <= 1:
+        return times, coords, coords
+    idx = np.arange(0, times.shape[0], step)
+    return times[idx], np.minimum.reduceat(coords, idx), \
+        np.maximum.reduceat(coords, idx)
+
+
+def concat(parts: List[Decimated], like: np.ndarray) -> Decimated:
+    """
+    :param like: Массив координат, форма и тип которого берутся для
+    пустого результата
+    """
+    parts = [i for i in parts if i[0].shape[0]]
+    if not parts:
+        empty = np.zeros((0,) + like.shape[1:], like.dtype)
+        return np.zeros(0), empty, empty
+    return tuple(np.concatenate(i) for i in zip(*parts))
+
+
+class MinMaxLevel:
+    """
+    Один уровень прореживания. Хранится в массивах постоянного размера,
+    которые заполняются по порядку и не копируются при добавлении новых
+    """
+
+    def __init__(self, factor: int, shape: Tuple[int, ...], dtype,
+                 chunk: int = 4096, single: bool = False) -> None:
+        """
+        :param factor: Сколько записей предыдущего уровня объединяется
+        в группу
+        :param shape: Форма координат одной записи
+        :param dtype: Тип координат
+        :param chunk: Количество записей в одном массиве
+        :param single: Минимумы и максимумы совпадают (исходные записи)
+        """
+        self.factor: int = factor
+        self.shape: Tuple[int, ...] = tuple(shape)
+        self.dtype = dtype
+        self.chunk: int = chunk
+        self.single: bool = single
+
+        self.times: List[np.ndarray] = []
+        self.mins: List[np.ndarray] = []
+        self.maxs: List[np.ndarray] = []
+        # Время начала каждого массива
+        self.first_times: List[float] = []
+        self.count: int = 0
+
+        # Записи предыдущего уровня, еще не собранные в группу
+        self.pending: Decimated = self.empty()
+
+    def empty(self) -> Decimated:
+        coords = np.zeros((0,) + self.shape, self.dtype)
+        return np.zeros(0), coords, coords
+
+    def add(self, times: np.ndarray, mins: np.ndarray,
+            maxs: np.ndarray) -> Decimated:
+        """
+        Добавляет записи предыдущего уровня
+        :return: Новые группы этого уровня
+        """
+        times, mins, maxs = concat([self.pending, (times, mins, maxs)],
+                                   mins)
+        n = times.shape[0] // self.factor * self.factor
+        self.pending = times[n:], mins[n:], maxs[n:]
+        if not n:
+            return self.empty()
+
+        f = self.factor
+        block = (times[:n:f],
+                 mins[:n].reshape((-1, f) + self.shape).min(1),
+                 maxs[:n].reshape((-1, f) + self.shape).max(1))
+        self.append(*block)
+        return block
+
+    def append(self, times: np.ndarray, mins: np.ndarray,
+               maxs: np.ndarray) -> None:
+        done = 0
+        while done < times.shape[0]:
+            pos = self.count % self.chunk
+            if not pos:
+                shape = (self.chunk,) + self.shape
+                self.times.append(np.zeros(self.chunk))
+                self.mins.append(np.zeros(shape, self.dtype))
+                self.maxs.append(self.mins[-1] if self.single else
+                                 np.zeros(shape, self.dtype))
+                self.first_times.append(float(times[done]))
+
+            n = min(self.chunk - pos, times.shape[0] - done)
+            self.times[-1][pos:pos + n] = times[done:done + n]
+            self.mins[-1][pos:pos + n] = mins[done:done + n]
+            if not self.single:
+                self.maxs[-1][pos:pos + n] = maxs[done:done + n]
+            self.count += n
+            done += n
+
+    def index(self, time: float) -> int:
+        # Номер первой записи уровня не раньше time
+        num = bisect_right(self.first_times, time) - 1
+        if num < 0:
+            return 0
+        size = min(self.chunk, self.count - num * self.chunk)
+        return num * self.chunk + int(np.searchsorted(
+            self.times[num][:size], time, side='left'))
+
+    def slice(self, start: int, end: int) -> Decimated:
+        # Записи уровня с номерами [start, end)
+        end = min(end, self.count)
+        parts = []
+        for num in range(start // self.chunk,
+                         -(-end // self.chunk) if end > start else 0):
+            offset = num * self.chunk
+            a, b = max(start - offset, 0), min(end - offset, self.chunk)
+            parts.append((self.times[num][a:b], self.mins[num][a:b],
+                          self.maxs[num][a:b]))
+        if not parts:
+            return self.empty()
+        return concat(parts, parts[0][1])
+
+
+class MinMaxPyramid:
+    """
+    Полная запись сеанса с уровнями прореживания. Каждый следующий
+    уровень хранит минимум и максимум групп по factor записей
+    предыдущего, поэтому для любого видимого отрезка берется уровень,
+    в котором на пиксель приходится не больше одной группы.
+    Уровни обновляются по мере добавления записей
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype, factor: int = 4,
+                 levels: int = 10) -> None:
+        """
+        :param shape: Форма координат одной записи
+        :param dtype: Тип координат
+        """
+        self.factor: int = factor
+        # Нулевой уровень - исходные записи
+        self.raw: MinMaxLevel = MinMaxLevel(1, shape, dtype, single=True)
+        self.levels: List[MinMaxLevel] = [
+            MinMaxLevel(factor, shape, dtype, 1024) for _ in range(levels)]
+
+    @property
+    def count(self) -> int:
+        return self.raw.count
+
+    @property
+    def end_time(self) -> Optional[float]:
+        # Время последней записи
+        if not self.raw.count:
+            return None
+        return float(self.raw.times[-1][(self.raw.count - 1) %
+                                        self.raw.chunk])
+
+    def extend(self, samples: Tuple[np.ndarray, np.ndarray]) -> None:
+        # Добавляет исходные записи: время и координаты
+        times, coords = samples
+        if not times.shape[0]:
+            return
+        self.raw.append(times, coords, coords)
+        block = times, coords, coords
+        for level in self.levels:
+            block = level.add(*block)
+            if not block[0].shape[0]:
+                break
+
+    def rows(self) -> Tuple[np.ndarray, np.ndarray]:
+        # Все исходные записи: время и координаты
+        times, coords, _ = self.raw.slice(0, self.raw.count)
+        return times, coords
+
+    def select(self, t0: float, t1: float,
+               width: int) -> Tuple[Decimated, int]:
+        """
+        Прореженные записи отрезка [t0, t1]
+        :param width: Ширина графика в пикселях
+        :return: (время, минимумы, максимумы) и количество исходных
+        записей в группе
+        """
+        levels = [self.raw] + self.levels
+        count = self.raw.index(t1 + 1e-9) - self.raw.index(t0)
+        num = 0
+        while num < len(self.levels) and \
+                count > width * self.factor ** num:
+            num += 1
+
+        level = levels[num]
+        # По одной группе за краями отрезка, чтобы линия не обрывалась
+        start = max(level.index(t0) - 1, 0)
+        end = level.index(t1 + 1e-9) + 1
+        parts = [level.slice(start, end)]
+
+        # Если отрезок доходит до конца записи, добавляем записи младших
+        # уровней, еще не собранные в группы этого уровня
+        if end > level.count:
+            parts.extend(i.pending for i in reversed(self.levels[:num]))
+        return concat(parts, parts[0][1]), self.factor ** num
@@ -0,0 +1,376 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from modules.tools import abspath
+
+
+def load_detection_settings() -> Dict[str, Any]:
+    # Загружаем настройки распознавания из файла
+    try:
+        with open(abspath('data/settings/detection_settings.json'),
+                  encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def create_detector(settings: Dict[str, Any]) -> 'ColorDetector':
+    # Создаем детектор по настройкам из detection_settings.json
+    return ColorDetector(min_area=settings.get('min_area', 100),
+                         tracking=settings.get('tracking', False),
+                         roi_size=settings.get('roi_size', 32),
+                         roi_motion_gain=settings.get('roi_motion_gain', 3.0),
+                         backend=settings.get('backend', 'moments'),
+                         lut_bits=settings.get('lut_bits', 6),
+                         pyramid=settings.get('pyramid', 1))
+
+
+class ColorLookupTable:
+    """
+    Таблица соответствия квантованного BGR цвета номеру метки.
+    Строится один раз по HSV диапазонам и позволяет разметить кадр и
+    посчитать центры всех меток за один проход без перевода кадра в HSV
+    """
+
+    def __init__(self, bits: int = 6) -> None:
+        # Количество старших бит каждого канала, которые учитываются
+        self.bits: int = bits
+        self.shift: int = 8 - bits
+
+        # Номер метки для каждого квантованного цвета. 0 - фон
+        self.table: np.ndarray = np.zeros(1 << (3 * bits), np.uint8)
+        self.names: List[str] = []
+
+    def build(self, colors: Dict[str, List[np.ndarray]]) -> None:
+        # Центры ячеек квантования по каждому каналу. Порядок ячеек
+        # совпадает с индексом из classify: r - старшие биты, b - младшие
+        levels = (np.arange(1 << self.bits) << self.shift) + \
+            (1 << self.shift) // 2
+        r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+        bgr = np.dstack((b.ravel(), g.ravel(), r.ravel())).astype(np.uint8)
+        hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+
+        self.table[:] = 0
+        self.names = list(colors.keys())[:255]
+        for label, name in enumerate(self.names, start=1):
+            hsv_min, hsv_max = colors[name]
+            inside = cv2.inRange(hsv, hsv_min, hsv_max).ravel() > 0
+            # При пересечении диапазонов цвет достается первой метке
+            self.table[inside & (self.table == 0)] = label
+
+    def classify(self, img: np.ndarray) -> np.ndarray:
+        # Упаковываем пиксель в 32-битное число (b - младший байт) и
+        # собираем из старших бит каждого канала индекс таблицы
+        packed = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA).view(np.uint32)
+        packed = packed[..., 0]
+        s, bits = self.shift, self.bits
+        mask = (1 << bits) - 1
+        idx = (packed >> s) & mask
+        idx |= (packed >> (8 + s - bits)) & (mask << bits)
+        idx |= (packed >> (16 + s - 2 * bits)) & (mask << (2 * bits))
+        return np.take(self.table, idx)
+
+    def centroids(self, img: np.ndarray, min_area: float) -> \
+            Dict[str, Tuple[float, float, float]]:
+        """
+        Разметка кадра и подсчет площади и суммы координат каждой метки
+        :return: {name: (x, y, area)} для меток площадью больше min_area
+        """
+        labels = self.classify(img).ravel()
+
+        # Метки занимают малую часть кадра, поэтому суммы координат
+        # считаем только по размеченным пикселям
+        pixels = np.flatnonzero(labels)
+        labels = labels[pixels]
+        ys, xs = np.divmod(pixels, img.shape[1])
+
+        n = len(self.names) + 1
+        area = np.bincount(labels, minlength=n)
+        sum_x = np.bincount(labels, weights=xs, minlength=n)
+        sum_y = np.bincount(labels, weights=ys, minlength=n)
+
+        return {name: (sum_x[label] / area[label], sum_y[label] / area[label],
+                       area[label])
+                for label, name in enumerate(self.names, start=1)
+                if area[label] > min_area}
+
+
+class Track:
+    # Состояние сопровождения метки между кадрами
+    def __init__(self, x: float, y: float, area: float) -> None:
+        self.x, self.y = x, y
+        # Примерный размер метки
+        self.size: float = np.sqrt(area)
+        # Смещение за последний кадр
+        self.vx = self.vy = 0.0
+        # Сглаженная величина смещения между кадрами
+        self.motion: float = 0.0
+
+    def update(self, x: float, y: float, area: float) -> None:
+        self.vx, self.vy = x - self.x, y - self.y
+        self.motion = (self.motion + abs(self.vx) + abs(self.vy)) / 2
+        self.x, self.y = x, y
+        self.size = np.sqrt(area)
+
+
+class ColorDetector:
+    """
+    Распознавание цветных меток на кадре. Не зависит от Qt, поэтому может
+    работать как в потоке интерфейса, так и в отдельном процессе.
+    Способы (backend):
+        moments - для каждого цвета inRange и моменты по HSV кадру
+        lut - все цвета за один проход по таблице BGR -> номер метки
+        components - маски всех цветов объединяются в одно изображение
+                     меток, по которому один вызов
+                     connectedComponentsWithStats находит все пятна. Для
+                     каждой метки берется самое большое пятно, поэтому
+                     отдельные пиксели похожего цвета не смещают центр
+    Режимы:
+        tracking - метка ищется только в окне вокруг предсказанного
+                   положения, размер окна растет со скоростью метки. Если
+                   метка в окне не найдена, то выполняется поиск по всему
+                   кадру
+        pyramid - поиск по всему кадру ведется на уменьшенной в pyramid раз
+                  копии, после чего центр метки уточняется в небольшом окне
+                  на кадре полного разрешения
+    """
+    BACKENDS = ('moments', 'lut', 'components')
+
+    def __init__(self, min_area: int = 100, tracking: bool = False,
+                 roi_size: int = 32, roi_motion_gain: float = 3.0,
+                 backend: str = 'moments', lut_bits: int = 6,
+                 pyramid: int = 1) -> None:
+        if backend not in self.BACKENDS:
+            raise ValueError(f'Unknown detection backend: {backend}')
+        self.backend: str = backend
+
+        # Минимальная площадь метки в пикселях
+        self.min_area: int = min_area
+
+        # Список цветов для распознавания {name: [hsv_min, hsv_max]}
+        self.colors: Dict[str, List[np.ndarray]] = {}
+
+        # Поиск в окне вокруг последнего положения метки
+        self.tracking: bool = tracking
+        # Минимальная половина стороны окна и ее прирост от скорости метки
+        self.roi_size: int = roi_size
+        self.roi_motion_gain: float = roi_motion_gain
+        self.tracks: Dict[str, Track] = {}
+
+        # Количество поисков в окне и возвратов к поиску по всему кадру
+        self.roi_searches: int = 0
+        self.fallbacks: int = 0
+
+        # Во сколько раз уменьшается кадр для грубого поиска
+        self.pyramid: int = max(1, int(pyramid))
+
+        # Таблица цветов для способа lut
+        self.lut = ColorLookupTable(lut_bits) if backend == 'lut' else None
+
+    def set_colors(self, colors_array: Dict[str, list]) -> None:
+        # Формируем новый список цветов для распознавания
+        new_colors = {k: [np.array(v[0], np.uint8),
+                          np.array(v[1], np.uint8)]
+                      for k, v in colors_array.items()}
+
+        # Таблицу перестраиваем, только если набор цветов изменился
+        if self.lut is not None and not self.same_colors(new_colors):
+            self.lut.build(new_colors)
+
+        self.colors = new_colors
+        self.tracks.clear()
+
+    def same_colors(self, colors: Dict[str, List[np.ndarray]]) -> bool:
+        return colors.keys() == self.colors.keys() and all(
+            np.array_equal(v[0], self.colors[k][0]) and
+            np.array_equal(v[1], self.colors[k][1])
+            for k, v in colors.items())
+
+    def fallback_rate(self) -> float:
+        # Доля поисков в окне, закончившихся поиском по всему кадру
+        return self.fallbacks / self.roi_searches if self.roi_searches else 0
+
+    def detect(self, img: np.ndarray,
+               mirror: bool = False) -> Dict[str, Tuple[int, int]]:
+        """
+        Поиск меток на кадре
+        :param img: BGR кадр
+        :param mirror: Вернуть координаты отраженного вдоль оси Y кадра,
+        не отражая сам кадр
+        :return: {name: (x, y)} для найденных меток
+        """
+        if not self.colors:
+            return {}
+
+        found: Dict[str, Tuple[float, float, float]] = {}
+
+        # Сперва ищем метки рядом с их прошлым положением
+        if self.tracking:
+            for name, track in self.tracks.items():
+                self.roi_searches += 1
+                half = int(self.roi_size + track.size +
+                           self.roi_motion_gain * track.motion)
+                pos = self.find_in_window(img, name, track.x + track.vx,
+                                          track.y + track.vy, half)
+                if pos is None:
+                    self.fallbacks += 1
+                else:
+                    found[name] = pos
+
+        # Ненайденные метки ищем по всему кадру
+        missing = [name for name in self.colors if name not in found]
+        if missing:
+            found.update(self.search_frame(img, missing))
+
+        if self.tracking:
+            self.update_tracks(found)
+
+        if mirror:
+            w = img.shape[1]
+            return {name: (int(w - 1 - x), int(y))
+                    for name, (x, y, _) in found.items()}
+        return {name: (int(x), int(y)) for name, (x, y, _) in found.items()}
+
+    def search_frame(self, img: np.ndarray, names: List[str]) -> \
+            Dict[str, Tuple[float, float, float]]:
+        f = self.pyramid
+        if f == 1:
+            return self.search_level(img, names, self.min_area)
+
+        # Грубый поиск на уменьшенном кадре
+        h, w = img.shape[:2]
+        small = cv2.resize(img, (w // f, h // f),
+                           interpolation=cv2.INTER_AREA)
+        coarse = self.search_level(small, names, self.min_area / (f * f))
+
+        # Уточнение центров на кадре полного разрешения
+        found = {}
+        for name, (x, y, area) in coarse.items():
+            x, y = (x + 0.5) * f - 0.5, (y + 0.5) * f - 0.5
+            half = int(np.sqrt(area) * f) + 2 * f
+            pos = self.find_in_window(img, name, x, y, half)
+            found[name] = pos if pos is not None else (x, y, area * f * f)
+        return found
+
+    def search_level(self, img: np.ndarray, names: List[str],
+                     min_area: float) -> \
+            Dict[str, Tuple[float, float, float]]:
+        if self.backend == 'components':
+            return self.find_blobs(img, names, min_area)
+        if self.lut is not None:
+            return {name: pos for name, pos in
+                    self.lut.centroids(img, min_area).items()
+                    if name in names}
+
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        found = {}
+        for name in names:
+            pos = self.find_color(hsv, name, min_area)
+            if pos is not None:
+                found[name] = pos
+        return found
+
+    def find_color(self, hsv: np.ndarray, name: str, min_area: float) -> \
+            Optional[Tuple[float, float, float]]:
+        # Распознавание цвета куба
+        hsv_min, hsv_max = self.colors[name]
+        thresh = cv2.inRange(hsv, hsv_min, hsv_max)
+        return self.centroid(thresh, min_area)
+
+    def label_image(self, img: np.ndarray, names: List[str]) -> np.ndarray:
+        # Изображение меток: names[i] отмечается значением len(names) - i,
+        # 0 - фон. При пересечении диапазонов пиксель достается цвету,
+        # который стоит в names раньше
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        labels = None
+        for i, name in enumerate(names):
+            hsv_min, hsv_max = self.colors[name]
+            mask = cv2.inRange(hsv, hsv_min, hsv_max)
+            cv2.bitwise_and(mask, len(names) - i, dst=mask)
+            labels = mask if labels is None else cv2.max(labels, mask)
+        return labels
+
+    def find_blobs(self, img: np.ndarray, names: List[str],
+                   min_area: float) -> Dict[str, Tuple[float, float, float]]:
+        """
+        Поиск самого большого пятна каждого цвета
+        :return: {name: (x, y, area)} для пятен площадью больше min_area
+        """
+        labels = self.label_image(img, names)
+        count, blobs, stats, centers = cv2.connectedComponentsWithStats(
+            labels, connectivity=8)
+
+        found = {}
+        # Пятно 0 - фон
+        for blob in np.flatnonzero(stats[1:, cv2.CC_STAT_AREA] > min_area):
+            blob += 1
+            x0, y0, w, h, area = stats[blob]
+            if len(names) == 1:
+                owner = 1
+            else:
+                # Если метки соприкасаются, то пятно достается цвету,
+                # занимающему в нем большую часть
+                window = labels[y0:y0 + h, x0:x0 + w]
+                inside = blobs[y0:y0 + h, x0:x0 + w] == blob
+                areas = np.bincount(window[inside], minlength=len(names) + 1)
+                owner = int(areas.argmax())
+                area = areas[owner]
+                if area <= min_area:
+                    continue
+
+            name = names[len(names) - owner]
+            if name not in found or area > found[name][2]:
+                x, y = centers[blob]
+                found[name] = (x, y, float(area))
+        return found
+
+    @staticmethod
+    def centroid(mask: np.ndarray, min_area: float) -> \
+            Optional[Tuple[float, float, float]]:
+        moments = cv2.moments(mask, 1)
+        dM01 = moments['m01']
+        dM10 = moments['m10']
+        dArea = moments['m00']
+
+        if dArea > min_area:
+            return dM10 / dArea, dM01 / dArea, dArea
+        return None
+
+    def find_in_window(self, img: np.ndarray, name: str, cx: float,
+                       cy: float, half: int) -> \
+            Optional[Tuple[float, float, float]]:
+        # Окно вокруг предполагаемого центра метки
+        h, w = img.shape[:2]
+        cx, cy = int(cx), int(cy)
+        x0, y0 = max(cx - half, 0), max(cy - half, 0)
+        x1, y1 = min(cx + half + 1, w), min(cy + half + 1, h)
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        window = img[y0:y1, x0:x1]
+        if self.backend == 'components':
+            pos = self.find_blobs(window, [name], self.min_area).get(name)
+        elif self.lut is not None:
+            label = self.lut.names.index(name) + 1
+            mask = (self.lut.classify(window) == label).view(np.uint8)
+            pos = self.centroid(mask, self.min_area)
+        else:
+            pos = self.find_color(cv2.cvtColor(window, cv2.COLOR_BGR2HSV),
+                                  name, self.min_area)
+        if pos is None:
+            return None
+        return pos[0] + x0, pos[1] + y0, pos[2]
+
+    def update_tracks(self, found: Dict[str, Tuple[float, float, float]]) \
+            -> None:
+        for name in self.colors:
+            if name not in found:
+                # Метка потеряна - на следующем кадре ищем по всему кадру
+                self.tracks.pop(name, None)
+            elif name in self.tracks:
+                self.tracks[name].update(*found[name])
+            else:
+                self.tracks[name] = Track(*found[name])
@@ -0,0 +1,141 @@
+import multiprocessing as mp
+import queue
+import time
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from modules.detection import create_detector
+
+
+def _detection_worker(shm_names: List[str], shape: tuple, dtype: str,
+                      tasks: mp.Queue, results: mp.Queue,
+                      settings: Dict[str, Any]) -> None:
+    # Подключаемся к слотам с кадрами, созданным главным процессом
+    shms = [SharedMemory(name=name) for name in shm_names]
+    frames = [np.ndarray(shape, dtype, buffer=shm.buf) for shm in shms]
+
+    detector = create_detector(settings)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+
+            if task[0] == 'colors':
+                detector.set_colors(task[1])
+                continue
+            if task[0] == 'pyramid':
+                detector.pyramid = task[1]
+                continue
+
+            _, idx, seq, timestamp = task
+            # Назад отправляем только координаты меток и время процессора,
+            # затраченное процессом распознавания
+            positions = detector.detect(frames[idx])
+            results.put((idx, seq, timestamp, positions, time.process_time()))
+    finally:
+        del frames
+        for shm in shms:
+            shm.close()
+
+
+class DetectionProcess:
+    """
+    Распознавание меток в отдельном процессе. Кадры передаются через слоты
+    multiprocessing.shared_memory без сериализации, обратно по очереди
+    приходят только координаты меток
+    """
+
+    def __init__(self, shape: tuple, dtype=np.uint8, slots: int = 3,
+                 settings: Dict[str, Any] = None) -> None:
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+
+        nbytes = int(np.prod(shape)) * self.dtype.itemsize
+        self._shms = [SharedMemory(create=True, size=nbytes)
+                      for _ in range(slots)]
+        self.frames: List[np.ndarray] = [
+            np.ndarray(shape, self.dtype, buffer=shm.buf)
+            for shm in self._shms]
+
+        # Свободные слоты. Ими распоряжается только главный процесс
+        self.free: List[int] = list(range(slots))
+
+        # Количество кадров, пропущенных из-за занятости процесса
+        self.dropped: int = 0
+
+        self.tasks = mp.Queue()
+        self.results = mp.Queue()
+
+        self.process = mp.Process(
+            target=_detection_worker, name='Detection-Process', daemon=True,
+            args=([shm.name for shm in self._shms], shape, self.dtype.str,
+                  self.tasks, self.results, settings or {}))
+        self.process.start()
+
+    def set_colors(self, colors_array: Dict[str, list]) -> None:
+        self.tasks.put(('colors', colors_array))
+
+    def set_pyramid(self, pyramid: int) -> None:
+        self.tasks.put(('pyramid', pyramid))
+
+    def submit(self, img: np.ndarray, seq: int, timestamp: float,
+               flip: bool = True) -> bool:
+        """
+        Передает кадр на распознавание
+        :param img: BGR кадр
+        :param seq: Номер кадра
+        :param timestamp: Время захвата кадра
+        :param flip: Отразить кадр вдоль оси Y при копировании в слот
+        :return: False, если все слоты заняты и кадр пропущен
+        """
+        if not self.free or img.shape != self.shape:
+            self.dropped += 1
+            return False
+
+        idx = self.free.pop()
+        if flip:
+            cv2.flip(img, 1, dst=self.frames[idx])
+        else:
+            np.copyto(self.frames[idx], img)
+
+        self.tasks.put(('frame', idx, seq, timestamp))
+        return True
+
+    def get(self, timeout: float = None) -> Optional[
+            Tuple[int, int, float, Dict[str, Tuple[int, int]], float]]:
+        """
+        Получает результат распознавания
+        :return: (idx, seq, timestamp, positions, cpu) или None.
+        cpu - суммарное время процессора процесса распознавания.
+        Кадр frames[idx] остается доступным до вызова release(idx)
+        """
+        try:
+            if timeout == 0:
+                return self.results.get_nowait()
+            return self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, idx: int) -> None:
+        # Возвращаем слот в список свободных
+        self.free.append(idx)
+
+    def busy(self) -> bool:
+        return not self.free
+
+    def close(self) -> None:
+        if self.process.is_alive():
+            self.tasks.put(None)
+            self.process.join(timeout=1)
+            if self.process.is_alive():
+                self.process.terminate()
+
+        self.frames.clear()
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
+        self._shms.clear()
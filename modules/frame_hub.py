@@ -0,0 +1,212 @@
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+
+class Frame(NamedTuple):
+    # Порядковый номер кадра с момента запуска камеры
+    seq: int
+    # Время захвата кадра (time.time())
+    timestamp: float
+    # Изображение. Валидно до следующего вызова get у подписчика
+    image: np.ndarray
+
+
+class FrameHub:
+    """
+    Кольцевой буфер кадров с предвыделенными слотами. Камера публикует в
+    него кадры, а подписчики ожидают появления новых кадров на условии.
+    Если есть блокирующие подписчики, камера ждет, пока в их очередях
+    освободится место, и кадры не теряются
+    """
+
+    def __init__(self, size: int = 4) -> None:
+        self.size: int = size
+
+        # Слоты кадров выделяются при первом кадре нужного размера
+        self._slots: List[Optional[np.ndarray]] = [None] * size
+        self._seqs: List[int] = [-1] * size
+        self._stamps: List[float] = [0.0] * size
+
+        # Номер последнего опубликованного кадра
+        self.seq: int = -1
+        self.closed: bool = False
+
+        # Был ли хотя бы один подписчик и подписчики, которые не должны
+        # терять кадры
+        self.subscribed: bool = False
+        self._blocking: List['FrameSubscriber'] = []
+
+        self._cond = threading.Condition()
+
+    def publish(self, image: np.ndarray, timestamp: float = None) -> int:
+        """
+        Копирует кадр в следующий слот и будит подписчиков
+        :param image: Кадр с камеры
+        :param timestamp: Время захвата кадра
+        :return: Номер опубликованного кадра
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self._cond:
+            seq = self.seq + 1
+            # Ждем, пока блокирующие подписчики заберут старые кадры
+            self._cond.wait_for(lambda: self.closed or all(
+                seq - i.last_seq <= i.maxsize for i in self._blocking))
+            idx = seq % self.size
+            # Помечаем слот как недоступный на время копирования
+            self._seqs[idx] = -1
+
+        slot = self._slots[idx]
+        if slot is None or slot.shape != image.shape or \
+                slot.dtype != image.dtype:
+            slot = self._slots[idx] = np.empty_like(image)
+        np.copyto(slot, image)
+
+        with self._cond:
+            self._seqs[idx] = seq
+            self._stamps[idx] = timestamp
+            self.seq = seq
+            self._cond.notify_all()
+        return seq
+
+    def latest(self) -> Optional[Frame]:
+        # Копия последнего опубликованного кадра без ожидания
+        with self._cond:
+            frame = self._get(self.seq)
+            if frame is None:
+                return None
+            return frame._replace(image=frame.image.copy())
+
+    def subscribe(self, policy: str = 'latest', maxsize: int = 1,
+                  block: bool = False) -> 'FrameSubscriber':
+        return FrameSubscriber(self, policy, maxsize, block)
+
+    def wait_subscribed(self, timeout: float = None) -> bool:
+        """
+        Ожидает первого подписчика, чтобы не потерять начало записи
+        :param timeout: Время ожидания в секундах. None - ждать бесконечно
+        :return: True, если подписчик появился
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self.subscribed or self.closed,
+                                timeout)
+            return self.subscribed
+
+    def open(self) -> None:
+        with self._cond:
+            self.closed = False
+
+    def close(self) -> None:
+        # Будим всех подписчиков, чтобы они могли завершить работу
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def _get(self, seq: int) -> Optional[Frame]:
+        idx = seq % self.size
+        if seq < 0 or self._seqs[idx] != seq:
+            return None
+        return Frame(seq, self._stamps[idx], self._slots[idx])
+
+
+class FrameSubscriber:
+    """
+    Подписчик на кадры FrameHub.
+    Политики:
+        latest - всегда отдается самый свежий кадр, пропущенные отбрасываются
+        queue - отдаются кадры по порядку, но отстающий подписчик хранит
+                не более maxsize кадров, более старые отбрасываются. С
+                block камера ждет подписчика, и кадры не отбрасываются.
+                Такого подписчика нужно закрыть, когда кадры больше не
+                нужны
+    Камера пишет в слоты без блокировки, поэтому неблокирующий подписчик
+    получает копию кадра в собственном буфере. Блокирующему отдается сам
+    слот: камера не перезапишет его, пока подписчик не возьмет следующий
+    кадр
+    """
+    LATEST = 'latest'
+    QUEUE = 'queue'
+
+    def __init__(self, hub: FrameHub, policy: str = LATEST,
+                 maxsize: int = 1, block: bool = False) -> None:
+        if policy not in (self.LATEST, self.QUEUE):
+            raise ValueError(f'Unknown drop policy: {policy}')
+        if block and policy != self.QUEUE:
+            raise ValueError('Only queue subscribers can block the camera')
+
+        self.hub = hub
+        self.policy = policy
+
+        # Очередь не может быть длиннее кольцевого буфера (один слот
+        # занят камерой под запись)
+        self.maxsize: int = max(1, min(maxsize, hub.size - 1))
+
+        # Номер последнего полученного кадра
+        self.last_seq: int = hub.seq
+
+        # Количество отброшенных кадров
+        self.dropped: int = 0
+
+        # Буфер под копию кадра для неблокирующего подписчика
+        self._image: Optional[np.ndarray] = None
+
+        self.block: bool = block
+        with hub._cond:
+            hub.subscribed = True
+            if block:
+                hub._blocking.append(self)
+            hub._cond.notify_all()
+
+    def close(self) -> None:
+        # Отписываемся, чтобы камера больше не ждала этого подписчика
+        with self.hub._cond:
+            if self in self.hub._blocking:
+                self.hub._blocking.remove(self)
+                self.hub._cond.notify_all()
+
+    def get(self, timeout: float = None) -> Optional[Frame]:
+        """
+        Ожидает новый кадр
+        :param timeout: Время ожидания в секундах. None - ждать бесконечно
+        :return: Frame или None, если кадр не дождались или хаб закрыт
+        """
+        cond = self.hub._cond
+        with cond:
+            if not cond.wait_for(
+                    lambda: self.hub.seq > self.last_seq or self.hub.closed,
+                    timeout):
+                return None
+            if self.hub.seq <= self.last_seq:
+                return None
+
+            if self.policy == self.LATEST:
+                seq = self.hub.seq
+            else:
+                seq = max(self.last_seq + 1, self.hub.seq - self.maxsize + 1)
+
+            frame = self.hub._get(seq)
+            if frame is None:
+                # Слот уже перезаписан - переходим к последнему кадру
+                seq = self.hub.seq
+                frame = self.hub._get(seq)
+
+            self.dropped += seq - self.last_seq - 1
+            self.last_seq = seq
+            if self.block:
+                # Место в очереди освободилось - будим камеру
+                cond.notify_all()
+                return frame
+            return frame._replace(image=self._copy(frame.image))
+
+    def _copy(self, image: np.ndarray) -> np.ndarray:
+        # Копия делается под блокировкой хаба, поэтому камера не начнет
+        # писать в этот слот
+        if self._image is None or self._image.shape != image.shape or \
+                self._image.dtype != image.dtype:
+            self._image = np.empty_like(image)
+        np.copyto(self._image, image)
+        return self._image
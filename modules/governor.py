@@ -0,0 +1,147 @@
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class QualityLevel(NamedTuple):
+    # Во сколько раз уменьшается кадр для грубого поиска меток
+    pyramid: int = 1
+    # Частота обработки кадров. 0 - обрабатывать каждый кадр
+    fps: float = 0
+    # Доля от разрешения камеры, заданного в настройках
+    scale: float = 1
+
+
+# Ступени качества от лучшей к худшей
+DEFAULT_LEVELS = [QualityLevel(1, 0, 1), QualityLevel(2, 0, 1),
+                  QualityLevel(2, 15, 1), QualityLevel(4, 10, 1),
+                  QualityLevel(4, 10, 0.5)]
+
+
+def create_governor(settings: Dict[str, Any],
+                    name: str = 'Camera') -> Optional['QualityGovernor']:
+    # Создаем регулятор по разделу governor из detection_settings.json
+    dct = settings.get('governor', {})
+    if not dct.get('enabled', False):
+        return None
+
+    levels = [QualityLevel(**i) for i in dct['levels']] \
+        if dct.get('levels') else list(DEFAULT_LEVELS)
+    # Самая качественная ступень совпадает с настройками распознавания
+    levels[0] = levels[0]._replace(pyramid=settings.get('pyramid', 1))
+    return QualityGovernor(budget=dct.get('budget_ms', 40) / 1000,
+                           levels=levels, window=dct.get('window', 25),
+                           headroom=dct.get('headroom', 0.5),
+                           hold=dct.get('hold', 3), name=name)
+
+
+class QualityGovernor:
+    """
+    Регулятор качества обработки. Сравнивает задержку обработки кадров
+    (от захвата до получения координат) с бюджетом и при его превышении
+    переходит на ступень с меньшим разрешением, большим уровнем пирамиды
+    или меньшей частотой обработки. При запасе по времени качество
+    возвращается обратно
+    """
+
+    def __init__(self, budget: float = 0.04,
+                 levels: List[QualityLevel] = None, window: int = 25,
+                 headroom: float = 0.5, hold: float = 3,
+                 name: str = 'Camera') -> None:
+        """
+        :param budget: Допустимая задержка обработки кадра (с)
+        :param levels: Ступени качества от лучшей к худшей
+        :param window: Количество кадров, по которым считается задержка
+        :param headroom: Доля бюджета, ниже которой качество повышается
+        :param hold: Минимальное время между переключениями (с)
+        """
+        self.name = name
+        self.budget: float = budget
+        self.levels: List[QualityLevel] = levels or list(DEFAULT_LEVELS)
+        self.headroom: float = headroom
+        self.hold: float = hold
+
+        # Текущая ступень
+        self.index: int = 0
+
+        # Задержки и время захвата последних кадров
+        self.latencies = deque(maxlen=window)
+        self.stamps = deque(maxlen=window)
+
+        # Частота поступления кадров при обработке каждого кадра
+        self.input_rate: Optional[float] = None
+
+        self._last_change: float = time.perf_counter()
+
+        # Ширина кадра на лучшей ступени. Координаты меток приводятся к
+        # ней, чтобы смена разрешения не меняла размах дыхания на графике
+        self.base_width: Optional[int] = None
+
+    @property
+    def level(self) -> QualityLevel:
+        return self.levels[self.index]
+
+    @property
+    def rate_scale(self) -> float:
+        # Доля обрабатываемых кадров на текущей ступени
+        fps = self.level.fps
+        if not fps or not self.input_rate:
+            return 1
+        return min(1.0, fps / self.input_rate)
+
+    def record(self, timestamp: float) -> Optional[QualityLevel]:
+        """
+        Учитывает задержку обработки кадра
+        :param timestamp: Время захвата обработанного кадра (time.time())
+        :return: Новая ступень качества, если ее нужно применить, иначе None
+        """
+        self.latencies.append(time.time() - timestamp)
+        self.stamps.append(timestamp)
+        if len(self.latencies) < self.latencies.maxlen or \
+                time.perf_counter() - self._last_change < self.hold:
+            return None
+
+        if not self.level.fps and self.stamps[-1] > self.stamps[0]:
+            self.input_rate = (len(self.stamps) - 1) / \
+                (self.stamps[-1] - self.stamps[0])
+
+        mean = sum(self.latencies) / len(self.latencies)
+        if mean > self.budget and self.index < len(self.levels) - 1:
+            return self.change(self.index + 1, mean)
+        if mean < self.budget * self.headroom and self.index > 0:
+            return self.change(self.index - 1, mean)
+        return None
+
+    def change(self, index: int, latency: float) -> QualityLevel:
+        log.info('%s: quality level %d -> %d %s, latency %.1f ms '
+                 '(budget %.1f ms)', self.name, self.index, index,
+                 tuple(self.levels[index]), latency * 1000,
+                 self.budget * 1000)
+
+        self.index = index
+        self.latencies.clear()
+        self.stamps.clear()
+        self._last_change = time.perf_counter()
+        return self.level
+
+    def frame_due(self, timestamp: float, last: Optional[float]) -> bool:
+        # Нужно ли обрабатывать кадр при текущей частоте обработки
+        fps = self.level.fps
+        return not fps or last is None or timestamp - last >= 1 / fps * 0.95
+
+    def normalize(self, positions: Dict[str, Tuple[int, int]],
+                  width: int) -> Dict[str, Tuple[int, int]]:
+        """
+        Приводит координаты меток к разрешению лучшей ступени
+        :param width: Ширина кадра, на котором найдены метки
+        """
+        if self.base_width is None:
+            self.base_width = width
+        if width == self.base_width:
+            return positions
+        k = self.base_width / width
+        return {name: (int(x * k), int(y * k))
+                for name, (x, y) in positions.items()}
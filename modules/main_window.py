@@ -1,31 +1,47 @@
 import json
+import time
 
 from PyQt5 import QtGui, uic
-from PyQt5.QtCore import QTimer, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import pyqtSignal, pyqtSlot
 from PyQt5.QtGui import QImage, QPixmap
-from PyQt5.QtWidgets import QMainWindow
+from PyQt5.QtWidgets import QMainWindow, QMessageBox
 
 from modules.analyzer import Analyzer
 from modules.camera_views import Camera, MainWindowCamera
+from modules.scheduler import Scheduler
 from modules.tools import abspath
+from modules.tracing import tracer
 
 
 class MainWindow(QMainWindow):
     closeWindowSignal = pyqtSignal()
 
-    def __init__(self, camera, network):
+    def __init__(self, camera, network, num: int = None):
         super().__init__()
         uic.loadUi(abspath('data/ui/main_window.ui'), self)
 
         self.cam_obj: Camera = camera
         self.network = network
 
+        # Номер камеры, если их несколько
+        self.num = num
+        self.title = self.windowTitle() if num is None else \
+            f'{self.windowTitle()} - камера {num}'
+        self.setWindowTitle(self.title)
+
         self.camera = self.color_range_wind = \
             self.graph_window = self.an_gr_set = \
             self.server_set = self.breath_logs_win = None
 
+        # Общие часы окна: прием координат, анализ, графики и надписи
+        self.scheduler = Scheduler(self)
         self.analyzer = Analyzer(self)
-        self.analyzer.newCoordinatesSignal.connect(self.set_coord_in_label)
+
+        # Надписи с координатами обновляются только при новых записях,
+        # состояние соединения и статистика - раз в 2 с
+        self.scheduler.add('labels', self.set_coord_in_label, 200,
+                           lambda: self.analyzer.received)
+        self.scheduler.add('status', self.update_status, 2000)
 
         # Цвета, доступные для выбора
         self.colors = {}
@@ -35,13 +51,9 @@ class MainWindow(QMainWindow):
 
         self.initUI()
 
-        # Таймер обновления состояния о подключении к серверу
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.check_network_state)
-        self.timer.start(2000)
-
         # Первичная проверка состояния
         self.check_network_state()
+        self.scheduler.start()
 
     def initUI(self) -> None:
         # Включаем камеру
@@ -65,6 +77,11 @@ class MainWindow(QMainWindow):
         self.restart_camera.triggered.connect(self.restart_cam)
         self.server_settings.triggered.connect(self.open_server_sett_window)
         self.open_logs_breath.triggered.connect(self.open_breath_logs_window)
+        self.show_preview.toggled.connect(self.set_preview_enabled)
+        self.record_session.setChecked(self.analyzer.record_session)
+        self.record_session.toggled.connect(self.set_session_recording)
+        self.show_latency.triggered.connect(self.show_latency_report)
+        self.dump_latency.triggered.connect(self.dump_latency_report)
 
         # Изменение настроек в главном окне
         for i in [self.curr_color_1, self.curr_color_2]:
@@ -80,10 +97,27 @@ class MainWindow(QMainWindow):
 
     def start_cam(self):
         if self.camera is None:
-            self.camera = MainWindowCamera(self.MainVideoBox, self.cam_obj)
+            self.camera = MainWindowCamera(self.MainVideoBox, self.cam_obj,
+                                           self.analyzer)
             self.camera.changePixmap.connect(self.setImage)
         self.camera.start()
 
+    def set_preview_enabled(self, flag: bool) -> None:
+        # Включение/отключение отображения картинки с камеры
+        self.camera.set_preview_enabled(flag)
+        if not flag:
+            self.MainVideoBox.clear()
+            self.MainVideoBox.setText('Изображение отключено')
+
+    def set_session_recording(self, flag: bool) -> None:
+        # Включение/отключение записи координат в файл сеанса
+        try:
+            self.analyzer.set_new_settings(record_session=flag)
+        except OSError as e:
+            QMessageBox.critical(self, 'Запись сеанса',
+                                 f'Не удалось начать запись:\n{e}')
+            self.record_session.setChecked(False)
+
     def restart_cam(self) -> None:
         self.cam_obj.restart()
         self.camera.restart()
@@ -165,8 +199,8 @@ class MainWindow(QMainWindow):
 
     def set_coord_in_label(self) -> None:
         # Получаем последние координаты и устанавливаем их в лэйблы
-        y1, y2, x1, x2 = map(lambda x: str(int(x)),
-                             self.analyzer.get_last_coordinates())
+        (y1, x1), (y2, x2) = map(lambda x: map(str, x),
+                                 self.analyzer.get_last_coordinates()[:2])
         self.val_x1.setText(x1)
         self.val_x2.setText(x2)
         self.val_y1.setText(y1)
@@ -210,6 +244,23 @@ class MainWindow(QMainWindow):
         self.breath_logs_win = BreathLogsWindow(self)
         self.breath_logs_win.show()
 
+    def show_latency_report(self) -> None:
+        # Перцентили задержек от захвата кадра до каждого этапа и
+        # статистика задач планировщика
+        QMessageBox.information(self, 'Задержки обработки',
+                                f'{tracer.report()}\n\n'
+                                f'{self.scheduler.report()}')
+
+    def dump_latency_report(self) -> None:
+        path = abspath(time.strftime('data/logs/latency_%Y%m%d_%H%M%S.json'))
+        try:
+            tracer.dump(path, {'scheduler': self.scheduler.stats()})
+            QMessageBox.information(self, 'Задержки обработки',
+                                    f'Задержки сохранены в файл\n{path}')
+        except OSError as e:
+            QMessageBox.critical(self, 'Задержки обработки',
+                                 f'Ошибка при сохранении:\n{e}')
+
     def save_breath_sett_to_json(self) -> None:
         # Сохраняем все настройки в файл
         try:
@@ -232,9 +283,14 @@ class MainWindow(QMainWindow):
         self.save_breath_sett_to_json()
         self.closeWindowSignal.emit()
 
-        # При закрытии приложения отключаемся от сервера
-        self.network.disconnect()
+        # От сервера отключаемся при выходе из приложения, так как
+        # соединение общее для всех окон
+        self.camera.stop()
+        self.camera.wait()
+        self.camera.close_worker()
         self.cam_obj.disconnect_camera()
+        self.scheduler.stop()
+        self.analyzer.close_recorder()
 
         super().closeEvent(a0)
 
@@ -255,6 +311,15 @@ class MainWindow(QMainWindow):
         if self.breath_logs_win:
             self.breath_logs_win.set_data(num, data)
 
+    def update_status(self) -> None:
+        self.check_network_state()
+        self.update_stats()
+
+    def update_stats(self) -> None:
+        # Частота обработки кадров и загрузка процессора в заголовке окна
+        self.setWindowTitle(f'{self.title} | {self.camera.fps:.1f} fps, '
+                            f'CPU {self.camera.cpu:.0f}%')
+
     def check_network_state(self, exp: str = None) -> None:
         # Проверка состояния соединения
         # Если есть ошибка, то выводим ее
@@ -276,5 +341,9 @@ class MainWindow(QMainWindow):
         # Отображаем логи
         self.set_logs_in_label()
 
+        trace = data.get('trace')
+        if trace is not None:
+            tracer.record('signal', trace['capture'], trace['id'])
+
         # Отправляем сигнал на сервер
-        self.network.send_signal()
+        self.network.send_signal(trace)
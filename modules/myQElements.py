@@ -49,3 +49,50 @@ class AutoClosedQWidget(QWidget):
         self.closeWindowSignal.emit()
 
         super().closeEvent(a0)
+
+
+class RegionSelectLabel(QLabel):
+    # Лэйбл с картинкой, на котором можно выделить прямоугольную область
+    regionSelected = pyqtSignal(QRect)
+
+    def __init__(self, parent=None):
+        QLabel.__init__(self, parent)
+        self.selecting = False
+        self._origin = QPoint()
+        self._band = QRubberBand(QRubberBand.Rectangle, self)
+
+    def set_selecting(self, flag: bool) -> None:
+        self.selecting = flag
+        self.setCursor(Qt.CrossCursor if flag else Qt.ArrowCursor)
+        self._band.hide()
+
+    def mousePressEvent(self, ev: QMouseEvent) -> None:
+        if self.selecting and ev.button() == Qt.LeftButton:
+            self._origin = ev.pos()
+            self._band.setGeometry(QRect(self._origin, QSize()))
+            self._band.show()
+        super().mousePressEvent(ev)
+
+    def mouseMoveEvent(self, ev: QMouseEvent) -> None:
+        if self.selecting and self._band.isVisible():
+            self._band.setGeometry(
+                QRect(self._origin, ev.pos()).normalized())
+        super().mouseMoveEvent(ev)
+
+    def mouseReleaseEvent(self, ev: QMouseEvent) -> None:
+        if self.selecting and self._band.isVisible():
+            self._band.hide()
+            # Область в координатах картинки, а не лэйбла
+            rect = self.to_pixmap_rect(
+                QRect(self._origin, ev.pos()).normalized())
+            if rect.width() > 1 and rect.height() > 1:
+                self.regionSelected.emit(rect)
+        super().mouseReleaseEvent(ev)
+
+    def to_pixmap_rect(self, rect: QRect) -> QRect:
+        # Картинка выравнивается по левому краю и центру по вертикали
+        pixmap = self.pixmap()
+        if pixmap is None or pixmap.isNull():
+            return QRect()
+        top = (self.height() - pixmap.height()) // 2
+        return rect.translated(0, -top).intersected(pixmap.rect())
@@ -0,0 +1,299 @@
+import json
+import logging
+import multiprocessing as mp
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from modules.breath import StreamingBreathDetector
+from modules.camera import Camera, create_camera
+from modules.detection import create_detector
+from modules.frame_hub import Frame, FrameSubscriber
+from modules.governor import create_governor
+from modules.recorder import SessionRecorder, session_path
+from modules.samples import SampleStore, record_columns
+from modules.tracing import tracer
+from modules.tools import abspath
+from modules.ws_client import WsClient
+
+log = logging.getLogger(__name__)
+
+
+def load_json(rel_path: str) -> Dict[str, Any]:
+    # Загружаем настройки из файла
+    try:
+        with open(abspath(rel_path), encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def load_colors() -> Dict[str, List[List[int]]]:
+    return {i['name']: [i['hsv_min'], i['hsv_max']]
+            for i in load_json('data/settings/colors_settings.json').get(
+                'Colors', [])}
+
+
+class PipelineStats:
+    """
+    Частота обработки кадров, загрузка процессора и отброшенные кадры
+    одной цепочки. Время процессора передается вызывающим, так как
+    считать его нужно в том потоке или процессе, где идет обработка
+    """
+
+    def __init__(self, interval: float = 5) -> None:
+        # Как часто выдавать отчет (с)
+        self.interval: float = interval
+
+        self.frames: int = 0
+        self.cpu: float = 0
+        # Всего отброшено кадров подписчиком
+        self.dropped: int = 0
+
+        self._last_time: float = time.perf_counter()
+        self._last_frames: int = 0
+        self._last_cpu: Optional[float] = None
+        self._last_dropped: int = 0
+
+    def frame(self, cpu: float, dropped: int = 0) -> None:
+        """
+        :param cpu: Суммарное время процессора цепочки (с)
+        :param dropped: Всего отброшено кадров подписчиком
+        """
+        self.frames += 1
+        self.cpu = cpu
+        self.dropped = dropped
+        if self._last_cpu is None:
+            self._last_cpu = cpu
+
+    def due(self) -> bool:
+        return time.perf_counter() - self._last_time >= self.interval
+
+    def report(self) -> Tuple[float, float, int]:
+        """
+        :return: (кадров в секунду, загрузка процессора в %, отброшено
+                 кадров) с прошлого отчета
+        """
+        now = time.perf_counter()
+        elapsed = now - self._last_time
+        fps = (self.frames - self._last_frames) / elapsed if elapsed else 0
+        cpu = (self.cpu - (self._last_cpu or self.cpu)) / elapsed * 100 \
+            if elapsed else 0
+
+        self._last_time, self._last_frames = now, self.frames
+        self._last_cpu = self.cpu
+        dropped = self.dropped - self._last_dropped
+        self._last_dropped = self.dropped
+        return fps, cpu, dropped
+
+
+class Pipeline:
+    """
+    Цепочка камера -> распознавание -> анализ дыхания -> сигнал на сервер
+    без Qt и графиков
+    """
+
+    def __init__(self, camera: Camera, colors: Dict[str, List[List[int]]],
+                 detection_settings: Dict[str, Any],
+                 breath_settings: Dict[str, Any],
+                 network: WsClient = None, name: str = 'Pipeline') -> None:
+        self.name = name
+        self.camera = camera
+        self.network = network
+
+        # Распознавание меток
+        self.detector = create_detector(detection_settings)
+        self.detector.set_colors(colors)
+
+        # Номер кривой для каждого цвета, как в главном окне
+        self.slots: Dict[str, int] = {name: num for num, name in
+                                      enumerate(colors, start=1)}
+        self.nums: List[int] = list(self.slots.values())
+
+        detail = breath_settings.get('DetailSettings', {})
+        self.store = SampleStore(detail.get('maxChunks', 300),
+                                 detail.get('save_full_data', False),
+                                 max(2, len(colors)))
+        # Запись координат в файл сеанса
+        self.record_session: bool = detail.get('record_session', False)
+
+        # Распознавание вдоха
+        self.breath = StreamingBreathDetector()
+        self.breath.tm_delta = breath_settings.get('TimeDelta', 2000)
+        self.breath.window_len = detail.get('window_len', 20)
+        self.breath.delta_top = [breath_settings.get('MinDeltaTop', 0),
+                                 breath_settings.get('MaxDeltaTop', 500)]
+        self.breath.delta_bot = [breath_settings.get('MinDeltaBot', 0),
+                                 breath_settings.get('MaxDeltaBot', 500)]
+
+        self.start_time: Optional[float] = None
+        # Количество обработанных кадров и зафиксированных вдохов
+        self.frames: int = 0
+        self.signals: int = 0
+
+        self.stats = PipelineStats()
+
+        # Регулятор качества под нагрузкой. Для записей без realtime время
+        # кадров - время записи, задержки по нему не считаются, и
+        # пропускать кадры незачем
+        self.governor = create_governor(detection_settings, name) \
+            if camera.realtime else None
+        self._last_processed: Optional[float] = None
+
+    def process(self, frame: Frame) -> Optional[Dict[str, Any]]:
+        """
+        Обработка одного кадра
+        :return: Данные о вдохе или None
+        """
+        if self.start_time is None:
+            self.start_time = frame.timestamp
+            if self.record_session:
+                self.store.recorder = SessionRecorder(
+                    session_path(self.name.replace(' ', '').lower()),
+                    self.start_time, record_columns(self.store.markers))
+        self.frames += 1
+
+        positions = self.detector.detect(frame.image, mirror=True)
+        # Время кадров записи без realtime - время в записи, задержки по
+        # нему не считаются
+        realtime = self.camera.realtime
+        if realtime:
+            tracer.record('detect', frame.timestamp)
+        if self.governor is not None:
+            positions = self.governor.normalize(positions,
+                                                frame.image.shape[1])
+        lap = self.store.append(frame.timestamp - self.start_time,
+                                {self.slots[name]: pos
+                                 for name, pos in positions.items()},
+                                self.nums, frame.seq)
+        self.breath.push_sample(self.store.get_last())
+        if lap:
+            self.breath.trim_detected_peaks()
+
+        if len(self.nums) < 2:
+            return None
+        signal = self.breath.detect(
+            self.store.get_window(self.breath.tm_delta / 1000))
+        if realtime:
+            tracer.record('analyse', frame.timestamp)
+
+        if signal is not None and realtime:
+            # Привязываем вдох к кадру, в котором был минимум всплеска
+            peak_time = self.breath.last_peak_time
+            signal['trace'] = {'id': self.store.find_trace(peak_time),
+                               'capture': self.start_time + peak_time}
+            tracer.record('breath', signal['trace']['capture'],
+                          signal['trace']['id'])
+        return signal
+
+    def run(self) -> None:
+        # Обрабатываем кадры, пока камера работает. Запись без realtime
+        # ждет цепочку и обрабатывается без потерь
+        if self.camera.realtime:
+            frames = self.camera.subscribe()
+        else:
+            frames = self.camera.subscribe(FrameSubscriber.QUEUE,
+                                           self.camera.hub.size - 1,
+                                           block=True)
+        try:
+            while True:
+                frame = frames.get(timeout=0.5)
+                if frame is None:
+                    # Дочитываем очередь после остановки камеры
+                    if not self.camera.isOpened():
+                        break
+                    continue
+                if not self.frame_due(frame):
+                    continue
+
+                signal = self.process(frame)
+                self.stats.frame(time.process_time(), frames.dropped)
+                self.govern(frame)
+
+                if signal is not None:
+                    self.signals += 1
+                    self.emit_signal(signal)
+
+                if self.stats.due():
+                    self.emit_stats(*self.stats.report())
+        finally:
+            frames.close()
+            self.close_recorder()
+
+        log.info('%s closed: %d frames, %d breaths, %d dropped', self.name,
+                 self.frames, self.signals, frames.dropped)
+        log.info('%s latency:\n%s', self.name, tracer.report())
+
+    def close_recorder(self) -> None:
+        if self.store.recorder is not None:
+            self.store.recorder.close()
+            log.info('%s session saved to %s', self.name,
+                     self.store.recorder.path)
+            self.store.recorder = None
+
+    def frame_due(self, frame: Frame) -> bool:
+        # Пропускаем кадры, если регулятор снизил частоту обработки
+        if self.governor is None:
+            return True
+        if not self.governor.frame_due(frame.timestamp, self._last_processed):
+            return False
+        self._last_processed = frame.timestamp
+        return True
+
+    def govern(self, frame: Frame) -> None:
+        if self.governor is None:
+            return
+        level = self.governor.record(frame.timestamp)
+        if level is not None:
+            self.detector.pyramid = level.pyramid
+            self.camera.set_scale(level.scale)
+            self.breath.window_scale = self.governor.rate_scale
+
+    def emit_signal(self, signal: Dict[str, Any]) -> None:
+        log.info('%s breath %d | %s', self.name, self.signals, signal)
+        trace = signal.get('trace')
+        if trace is not None:
+            tracer.record('signal', trace['capture'], trace['id'])
+        if self.network is not None:
+            self.network.send_signal(trace)
+
+    def emit_stats(self, fps: float, cpu: float, dropped: int) -> None:
+        log.info('%s: %.1f fps, CPU %.0f%%, dropped %d', self.name, fps, cpu,
+                 dropped)
+
+
+class ProcessPipeline(Pipeline):
+    """
+    Цепочка, работающая в отдельном процессе. Вдохи и статистика
+    передаются в главный процесс через очередь
+    """
+
+    def __init__(self, num: int, events: mp.Queue, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.num = num
+        self.events = events
+
+    def emit_signal(self, signal: Dict[str, Any]) -> None:
+        self.events.put(('signal', self.num, signal))
+
+    def emit_stats(self, fps: float, cpu: float, dropped: int) -> None:
+        self.events.put(('stats', self.num, fps, cpu, dropped))
+
+
+def run_pipeline_process(num: int, events: mp.Queue,
+                         camera_settings: Dict[str, Any],
+                         colors: Dict[str, List[List[int]]],
+                         detection_settings: Dict[str, Any],
+                         breath_settings: Dict[str, Any]) -> None:
+    # Точка входа процесса одной камеры
+    camera = create_camera(camera_settings, name=f'Threading-Camera-{num}')
+    pipeline = ProcessPipeline(num, events, camera, colors,
+                               detection_settings, breath_settings,
+                               name=f'Camera {num}')
+    try:
+        pipeline.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        camera.disconnect_camera()
+        events.put(('closed', num, pipeline.frames, pipeline.signals,
+                    tracer.percentiles()))
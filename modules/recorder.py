@@ -0,0 +1,229 @@
+import json
+import os
+import struct
+import time
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from modules.tools import abspath
+
+# Папка для записей сеансов
+SESSIONS_DIR = 'data/sessions'
+
+# Столбец записи: название и тип numpy ('<f8', '<i2', ...)
+Column = Tuple[str, str]
+
+MAGIC = b'VISDREC1'
+VERSION = 2
+# Формат файла сеанса (little-endian):
+#   0 - заголовок HEADER (36 байт): метка формата, версия (uint32),
+#       количество столбцов (uint32), записей в блоке (uint32), время
+#       начала сеанса (float64, time.time()), количество записей (uint64)
+#   36 - названия и типы столбцов в json: [[название, тип numpy], ...].
+#       Для SampleStore это time (<f8), затем y и x каждой метки (<i2):
+#       y1, x1, y2, x2, ..., и номер кадра trace (<i4)
+#   HEADER_SIZE - блоки данных. Заголовок дополняется нулями до этого
+#       смещения. В блоке значения каждого столбца лежат подряд, по
+#       записей в блоке на столбец. Последний блок заполнен частично,
+#       действительны первые "количество записей" записей файла
+HEADER = struct.Struct('<8sIIIdQ')
+HEADER_SIZE = 1024
+
+
+def session_path(name: str = '') -> str:
+    # Путь к файлу нового сеанса
+    suffix = f'_{name}' if name else ''
+    return abspath(os.path.join(
+        SESSIONS_DIR, time.strftime(f'session_%Y%m%d_%H%M%S{suffix}.rec')))
+
+
+def read_header(file) -> Tuple[int, float, int, List[Column]]:
+    """
+    :return: (записей в блоке, время начала, записей, столбцы)
+    """
+    raw = file.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE:
+        raise ValueError('Session file is too short')
+    magic, version, ncols, block, start, count = HEADER.unpack_from(raw)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a session file')
+    columns = json.loads(raw[HEADER.size:].rstrip(b'\0').decode('utf-8'))
+    if len(columns) != ncols:
+        raise ValueError('Broken session header')
+    return block, start, count, [tuple(i) for i in columns]
+
+
+def block_dtype(columns: Sequence[Column], block: int) -> np.dtype:
+    # Блок файла: значения каждого столбца подряд, в своем типе
+    return np.dtype([(name, dtype, (block,)) for name, dtype in columns])
+
+
+class SessionRecorder:
+    """
+    Запись сеанса в файл на диске. Файл разбит на блоки по block
+    записей, внутри блока значения лежат по столбцам, каждый в своем
+    типе. Файл отображается в память и дописывается по мере поступления
+    записей, поэтому объем памяти не зависит от длины сеанса. Количество
+    записей в заголовке обновляется при периодическом сбросе на диск
+    """
+
+    def __init__(self, path: str, start_time: float,
+                 columns: Sequence[Column], block: int = 4096,
+                 reserve: int = 16, flush_interval: float = 5) -> None:
+        """
+        :param path: Путь к файлу сеанса
+        :param start_time: Время, от которого отсчитывается время записей
+        :param columns: Столбцы [(название, тип)]
+        :param block: Количество записей в блоке
+        :param reserve: На сколько блоков увеличивается файл при нехватке
+        :param flush_interval: Как часто сбрасывать записи на диск (с)
+        """
+        self.path = path
+        self.start_time = start_time
+        self.columns = [tuple(i) for i in columns]
+        self.block = block
+        self._dtype = block_dtype(self.columns, block)
+        self.reserve = reserve
+        self.flush_interval = flush_interval
+
+        self.count: int = 0
+        self._blocks: int = 0
+        self._map: Optional[np.memmap] = None
+        # Столбцы отображенного файла, каждый в форме (блоков, block)
+        self._cols: List[np.ndarray] = []
+        self._last_flush: float = time.perf_counter()
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._file = open(path, 'w+b')
+        self._write_header()
+        self._grow()
+
+    def _write_header(self) -> None:
+        names = json.dumps(self.columns).encode('utf-8')
+        header = HEADER.pack(MAGIC, VERSION, len(self.columns), self.block,
+                             self.start_time, self.count) + names
+        if len(header) > HEADER_SIZE:
+            raise ValueError('Too many columns for the session header')
+        self._file.seek(0)
+        self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+
+    def _grow(self) -> None:
+        # Увеличиваем файл на reserve блоков и заново отображаем в память
+        if self._map is not None:
+            self._map.flush()
+        self._blocks += self.reserve
+        self._file.truncate(HEADER_SIZE + self._blocks * self._dtype.itemsize)
+        self._map = np.memmap(self._file, self._dtype, 'r+', HEADER_SIZE,
+                              (self._blocks,))
+        self._cols = [self._map[name] for name, _ in self.columns]
+
+    def append(self, values: Sequence[Any]) -> None:
+        """
+        Дописывает запись
+        :param values: Значения всех столбцов по порядку
+        """
+        num, pos = divmod(self.count, self.block)
+        if num >= self._blocks:
+            self._grow()
+        for col, value in zip(self._cols, values):
+            col[num, pos] = value
+        self.count += 1
+
+        if time.perf_counter() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        # Сначала данные, затем количество записей в заголовке
+        self._map.flush()
+        self._write_header()
+        self._file.flush()
+        self._last_flush = time.perf_counter()
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self.flush()
+        self._map, self._cols = None, []
+        # Отрезаем неиспользованные блоки
+        used = -(-self.count // self.block)
+        self._file.truncate(HEADER_SIZE + used * self._dtype.itemsize)
+        self._file.close()
+
+
+class SessionFile:
+    """
+    Чтение записанного сеанса. Файл отображается в память, в память
+    читаются только запрошенные записи
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as file:
+            self.block, self.start_time, self.count, \
+                self.columns = read_header(file)
+        self.names: List[str] = [name for name, _ in self.columns]
+
+        # Количество меток по столбцам y1, x1, y2, x2...
+        self.markers: int = sum(1 for name in self.names
+                                if name[0] == 'y' and name[1:].isdigit())
+
+        blocks = -(-self.count // self.block)
+        dtype = block_dtype(self.columns, self.block)
+        self._map = np.memmap(path, dtype, 'r', HEADER_SIZE, (blocks,)) \
+            if blocks else np.zeros(0, dtype)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def column(self, name: str, start: int = 0,
+               end: int = None) -> np.ndarray:
+        """
+        Значения одного столбца для записей с номерами [start, end)
+        """
+        end = self.count if end is None else min(end, self.count)
+        col = self._map[name]
+        if start >= end:
+            return np.zeros(0, col.dtype)
+        first, last = start // self.block, (end - 1) // self.block
+        offset = first * self.block
+        return col[first:last + 1].reshape(-1)[start - offset:end - offset]
+
+    def samples(self, start: int = 0, end: int = None):
+        """
+        Время и координаты меток записей с номерами [start, end)
+        :return: Samples
+        """
+        # Импорт здесь, так как модуль samples сам импортирует recorder
+        from modules.samples import Samples
+        times = self.column('time', start, end)
+        coords = np.stack([np.stack([self.column(f'y{num}', start, end),
+                                     self.column(f'x{num}', start, end)],
+                                    -1)
+                           for num in range(1, self.markers + 1)], 1)
+        return Samples(times, coords)
+
+    def index(self, time: float) -> int:
+        # Номер первой записи не раньше time (время от начала сеанса)
+        if not self.count:
+            return 0
+        times = self._map['time']
+        # Время первой записи каждого блока
+        num = int(np.searchsorted(times[:, 0], time, side='right')) - 1
+        if num < 0:
+            return 0
+        end = min(self.block, self.count - num * self.block)
+        return num * self.block + int(np.searchsorted(
+            times[num, :end], time, side='left'))
+
+    def window(self, t0: float, t1: float):
+        # Записи за отрезок времени [t0, t1]
+        return self.samples(self.index(t0),
+                            self.index(np.nextafter(t1, np.inf)))
+
+    def iter_samples(self, size: int = 4096) -> Iterator:
+        # Последовательное чтение сеанса частями для повторного анализа
+        for start in range(0, self.count, size):
+            yield self.samples(start, start + size)
@@ -0,0 +1,332 @@
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from modules.decimation import Decimated, MinMaxPyramid, concat, decimate
+from modules.recorder import SessionRecorder
+
+# Запись о кадре: время захвата, координаты меток по номерам кривых и
+# номер кадра для трассировки задержек
+Sample = Tuple[float, Dict[int, Tuple[int, int]], int]
+
+# Типы данных массива координат
+TIME_DTYPE = np.float64
+COORD_DTYPE = np.int16
+TRACE_DTYPE = np.int32
+# Индексы координат метки. В столбце y хранится первая координата
+# центра метки, в столбце x - вторая
+Y, X = 0, 1
+
+
+class Samples(NamedTuple):
+    """
+    Срез записей: время (float64) и координаты меток (int16) в формате
+    [запись, метка, (y, x)]
+    """
+    times: np.ndarray
+    coords: np.ndarray
+
+    def slice(self, start: int, end: int = None) -> 'Samples':
+        return Samples(self.times[start:end], self.coords[start:end])
+
+    @classmethod
+    def empty(cls, markers: int = 2) -> 'Samples':
+        return cls(np.zeros(0, TIME_DTYPE),
+                   np.zeros((0, markers, 2), COORD_DTYPE))
+
+    @classmethod
+    def from_rows(cls, rows: np.ndarray) -> 'Samples':
+        """
+        Записи из массива в прежнем формате: строки (time, y1, y2, ...,
+        x1, x2, ...), как в массиве графика до разделения на время и
+        координаты. Лишний последний столбец (номер кадра) отбрасывается
+        """
+        markers = (rows.shape[1] - 1) // 2
+        coords = np.empty((rows.shape[0], markers, 2), COORD_DTYPE)
+        coords[:, :, Y] = rows[:, 1:1 + markers]
+        coords[:, :, X] = rows[:, 1 + markers:1 + 2 * markers]
+        return cls(rows[:, 0].astype(TIME_DTYPE), coords)
+
+
+def record_columns(markers: int) -> List[Tuple[str, str]]:
+    # Столбцы файла сеанса: время, координаты каждой метки, номер кадра
+    coords = [(f'{axis}{num}', np.dtype(COORD_DTYPE).str)
+              for num in range(1, markers + 1) for axis in 'yx']
+    return [('time', np.dtype(TIME_DTYPE).str)] + coords + \
+        [('trace', np.dtype(TRACE_DTYPE).str)]
+
+
+def ring_size(max_chunks: int) -> int:
+    # Длина кольца SampleStore. Запас в четверть окна не дает перезаписать
+    # срезы, которые графики еще не успели перерисовать
+    return max_chunks + max(1, max_chunks // 4)
+
+
+class SampleQueue:
+    """
+    Очередь координат от одного источника (потока камеры) к одному
+    потребителю (графику). append и popleft у deque потокобезопасны,
+    поэтому блокировки не нужны
+    """
+
+    def __init__(self) -> None:
+        self._queue = deque()
+        # Общее количество добавленных записей. Меняется только в потоке
+        # источника
+        self.pushed: int = 0
+
+    def push(self, timestamp: float, positions: Dict[int, Tuple[int, int]],
+             trace: int = -1) -> None:
+        self._queue.append((timestamp, positions, trace))
+        self.pushed += 1
+
+    def drain(self) -> List[Sample]:
+        # Забираем все накопившиеся записи
+        samples = []
+        while self._queue:
+            samples.append(self._queue.popleft())
+        return samples
+
+    def clear(self) -> None:
+        self._queue.clear()
+
+
+class SampleStore:
+    """
+    Кольцевой массив координат меток фиксированного размера. Время
+    хранится в float64, координаты любого количества меток - в int16.
+    Каждая запись хранится дважды - в ячейке кольца и в ее копии во
+    второй половине массива, поэтому последние записи всегда лежат
+    подряд и отдаются срезом без копирования. Массив не пересоздается
+    при заполнении.
+    Если координата метки в кадре не пришла, то повторяется последняя
+    известная
+    """
+
+    def __init__(self, max_chunks: int = 300, save_full_data: bool = False,
+                 markers: int = 2) -> None:
+        # Сохранять ли записи, вытесненные из кольца
+        self.save_full_data: bool = save_full_data
+
+        # Запись сеанса на диск
+        self.recorder: Optional[SessionRecorder] = None
+
+        self.markers: int = markers
+        self._reset_markers()
+        self._allocate(max_chunks)
+
+    def _reset_markers(self) -> None:
+        # Полные круги кольца, сохраненные при save_full_data, с уровнями
+        # прореживания для графика
+        self.history: MinMaxPyramid = MinMaxPyramid((self.markers, 2),
+                                                    COORD_DTYPE)
+        # Последние известные координаты каждой метки
+        self.last: np.ndarray = np.zeros((self.markers, 2), COORD_DTYPE)
+
+    def _allocate(self, max_chunks: int) -> None:
+        # Максимально количество записей в окне данных
+        self.maxChunks: int = max_chunks
+        # Длина кольца
+        self.size: int = ring_size(max_chunks)
+
+        # Кольцо и его копия
+        self._times: np.ndarray = np.zeros(self.size * 2, TIME_DTYPE)
+        self._coords: np.ndarray = np.zeros(
+            (self.size * 2, self.markers, 2), COORD_DTYPE)
+        # Номера кадров для каждой записи
+        self._traces: np.ndarray = np.full(self.size * 2, -1, TRACE_DTYPE)
+
+        # Общее количество записей
+        self.count: int = 0
+        # Начало еще не сохраненных записей текущего круга
+        self._lap_start: int = 0
+
+    @property
+    def ptr(self) -> int:
+        # Количество записей в окне данных
+        return min(self.count, self.maxChunks)
+
+    @property
+    def data(self) -> Samples:
+        # Окно последних записей
+        return self.view()
+
+    def _end(self) -> int:
+        # Индекс после последней записи во второй половине массива
+        return (self.count - 1) % self.size + self.size + 1
+
+    def _range(self, n: Optional[int]) -> Tuple[int, int]:
+        n = self.ptr if n is None else min(n, self.ptr)
+        if not n:
+            return 0, 0
+        end = self._end()
+        return end - n, end
+
+    def view(self, n: int = None) -> Samples:
+        """
+        Последние n записей в порядке времени. Срезы массивов, а не копии
+        :param n: Количество записей. По умолчанию все окно
+        """
+        start, end = self._range(n)
+        return Samples(self._times[start:end], self._coords[start:end])
+
+    def trace_view(self, n: int = None) -> np.ndarray:
+        # Номера кадров последних n записей
+        start, end = self._range(n)
+        return self._traces[start:end]
+
+    def set_markers(self, markers: int) -> None:
+        """
+        Меняет количество меток. Записи окна сохраняются, история
+        начинается заново
+        """
+        if markers == self.markers:
+            return
+        data, traces = self.view(), self.trace_view().copy()
+        times = data.times.copy()
+        coords = np.zeros((times.shape[0], markers, 2), COORD_DTYPE)
+        n = min(markers, self.markers)
+        coords[:, :n] = data.coords[:, :n]
+
+        self.markers = markers
+        self._reset_markers()
+        self._allocate(self.maxChunks)
+        self._put(times, coords, traces)
+
+    def append(self, time: float, positions: Dict[int, Tuple[int, int]],
+               nums: List[int], trace: int = -1) -> bool:
+        """
+        Добавляет запись в массив
+        :param time: Время записи
+        :param positions: Новые координаты {num: (x, y)}
+        :param nums: Номера кривых, которые записываются в массив
+        :param trace: Номер кадра
+        :return: True, если кольцо прошло полный круг
+        """
+        last = self.last
+        for num, pos in positions.items():
+            last[num - 1] = pos
+
+        pos = self.count % self.size
+        # Указываем координату времени
+        self._times[pos] = self._times[pos + self.size] = time
+
+        # Устанавливаем координаты цветов
+        row = self._coords[pos]
+        if len(nums) == self.markers:
+            row[:] = last
+        else:
+            row[:] = 0
+            for num in nums:
+                row[num - 1] = last[num - 1]
+
+        # Копия записи во второй половине массива
+        self._coords[pos + self.size] = row
+        self._traces[pos] = self._traces[pos + self.size] = trace
+        self.count += 1
+
+        if self.recorder is not None:
+            self.recorder.append((time, *row.ravel().tolist(), trace))
+
+        if self.count % self.size:
+            return False
+        # Первая половина массива - только что заполненный круг
+        if self.save_full_data:
+            self.history.extend(self._lap())
+        self._lap_start = 0
+        return True
+
+    def _put(self, times: np.ndarray, coords: np.ndarray,
+             traces: np.ndarray) -> None:
+        # Записываем перенесенные записи в начало нового кольца
+        n = times.shape[0]
+        for offset in (0, self.size):
+            self._times[offset:offset + n] = times
+            self._coords[offset:offset + n] = coords
+            self._traces[offset:offset + n] = traces
+        # Перенесенные записи уже сохранены в истории
+        self.count = self._lap_start = n
+
+    def resize(self, max_chunks: int) -> None:
+        # Меняем размер окна с сохранением последних записей
+        if max_chunks == self.maxChunks:
+            return
+        if self.save_full_data:
+            self.history.extend(self._lap())
+        data = self.view(max_chunks)
+        times, coords = data.times.copy(), data.coords.copy()
+        traces = self.trace_view(max_chunks).copy()
+
+        self._allocate(max_chunks)
+        self._put(times, coords, traces)
+
+    def _lap(self) -> Samples:
+        # Несохраненные записи текущего круга
+        end = self.count % self.size
+        return Samples(self._times[self._lap_start:end],
+                       self._coords[self._lap_start:end])
+
+    def full_data(self) -> Samples:
+        # Все сохраненные записи, включая вытесненные из кольца
+        history, lap = Samples(*self.history.rows()), self._lap()
+        return Samples(np.concatenate([history.times, lap.times]),
+                       np.concatenate([history.coords, lap.coords]))
+
+    def plot_data(self, width: int, t0: float = None,
+                  t1: float = None) -> Decimated:
+        """
+        Данные для графика, прореженные до пары минимум/максимум на
+        пиксель. Объем не зависит от длины записи
+        :param width: Ширина графика в пикселях
+        :param t0: Начало видимого отрезка. По умолчанию начало записи
+        :param t1: Конец видимого отрезка. По умолчанию конец записи
+        """
+        full = self.save_full_data and self.history.count
+        # Записи, еще не попавшие в историю
+        tail = self._lap() if full else self.view()
+        times = tail.times
+        if not full and not times.shape[0]:
+            return concat([], tail.coords)
+
+        if t0 is None:
+            t0 = self.history.raw.first_times[0] if full else times[0]
+        if t1 is None:
+            t1 = times[-1] if times.shape[0] else self.history.end_time
+
+        parts, step = [], 1
+        if full:
+            data, step = self.history.select(t0, t1, width)
+            parts.append(data)
+            if t1 < self.history.end_time:
+                return data
+
+        start = max(np.searchsorted(times, t0, side='left') - 1, 0)
+        end = np.searchsorted(times, t1, side='right') + 1
+        tail = tail.slice(start, end)
+        step = max(step, -(-tail.times.shape[0] // max(width, 1)))
+        parts.append(decimate(tail, step))
+        return concat(parts, tail.coords)
+
+    def get_last(self) -> np.ndarray:
+        # Координаты последней записи [метка, (y, x)]
+        if not self.count:
+            return self._coords[0]
+        return self._coords[self._end() - 1]
+
+    def get_window(self, tm_delta: float) -> Samples:
+        # Срез данных за последние tm_delta секунд
+        data = self.view()
+        times = data.times
+        if not times.shape[0]:
+            return data
+        start = np.searchsorted(times, times[-1] - tm_delta, side='left')
+        return data.slice(start)
+
+    def find_trace(self, time: float) -> int:
+        # Номер кадра, записанного в момент time
+        times = self.view().times
+        idx = np.searchsorted(times, time, side='left')
+        if idx >= times.shape[0]:
+            return -1
+        return int(self.trace_view()[idx])
@@ -0,0 +1,170 @@
+import math
+import time
+from functools import reduce
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from PyQt5.QtCore import QObject, Qt, QTimer
+
+
+class Task:
+    """
+    Периодическая задача планировщика
+    """
+
+    def __init__(self, name: str, callback: Callable[[], Any],
+                 interval: int,
+                 inputs: Optional[Callable[[], Hashable]] = None) -> None:
+        """
+        :param name: Название задачи
+        :param callback: Работа задачи
+        :param interval: Период запуска (мс)
+        :param inputs: Возвращает состояние входных данных задачи. Если
+        оно не изменилось с прошлого запуска, то запуск пропускается
+        """
+        self.name: str = name
+        self.callback: Callable[[], Any] = callback
+        self.interval: int = interval
+        self.inputs: Optional[Callable[[], Hashable]] = inputs
+
+        # Период в тактах планировщика и номер такта следующего запуска
+        self.period: int = 1
+        self.next_tick: int = 0
+        # Состояние входных данных при прошлом запуске
+        self.state: Hashable = None
+
+        # Запуски, пропуски из-за неизменных данных, запуски дольше
+        # периода и такты, пропущенные из-за опоздания
+        self.runs: int = 0
+        self.skips: int = 0
+        self.overruns: int = 0
+        self.missed: int = 0
+        # Суммарное и наибольшее время работы (с)
+        self.busy: float = 0
+        self.worst: float = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {'interval': self.interval, 'runs': self.runs,
+                'skips': self.skips, 'overruns': self.overruns,
+                'missed': self.missed,
+                'mean_ms': round(self.busy / self.runs * 1000, 2)
+                if self.runs else 0,
+                'max_ms': round(self.worst * 1000, 2)}
+
+
+class Scheduler(QObject):
+    """
+    Единые часы окна. Один таймер срабатывает раз в такт - наибольший
+    общий делитель периодов задач, и запускает задачи, чей такт
+    наступил, в порядке их добавления. Поэтому задачи с кратными
+    периодами всегда выполняются в одном такте и в одном порядке:
+    прием координат, анализ, графики, надписи
+    """
+
+    def __init__(self, parent: QObject = None, resolution: int = 10) -> None:
+        """
+        :param resolution: Точность периодов (мс). Периоды задач
+        округляются до кратных ей
+        """
+        super().__init__(parent)
+        self.resolution: int = resolution
+        # Длина такта (мс)
+        self.tick: int = resolution
+
+        self.tasks: Dict[str, Task] = {}
+
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.run)
+        self._start: float = time.perf_counter()
+
+    def add(self, name: str, callback: Callable[[], Any], interval: int,
+            inputs: Optional[Callable[[], Hashable]] = None) -> Task:
+        """
+        Добавляет задачу. Параметры как у Task
+        """
+        task = Task(name, callback, interval, inputs)
+        self.tasks[name] = task
+        self.set_interval(name, interval)
+        return task
+
+    def remove(self, name: str) -> None:
+        if self.tasks.pop(name, None) is not None:
+            self._update_tick()
+
+    def interval(self, name: str) -> int:
+        return self.tasks[name].interval
+
+    def set_interval(self, name: str, interval: int) -> None:
+        # Меняем период задачи (мс)
+        task = self.tasks[name]
+        task.interval = max(self.resolution,
+                            round(interval / self.resolution) *
+                            self.resolution)
+        self._update_tick()
+
+    def _update_tick(self) -> None:
+        # Такт - наибольший общий делитель периодов всех задач
+        self.tick = reduce(math.gcd, (i.interval for i in
+                                      self.tasks.values()), 0) or \
+            self.resolution
+        now = self._tick_number()
+        for task in self.tasks.values():
+            task.period = task.interval // self.tick
+            task.next_tick = (now // task.period + 1) * task.period
+        self.timer.setInterval(self.tick)
+
+    def _tick_number(self) -> int:
+        return int((time.perf_counter() - self._start) * 1000 // self.tick)
+
+    def start(self) -> None:
+        self._start = time.perf_counter()
+        for task in self.tasks.values():
+            task.next_tick = 0
+        self.timer.start(self.tick)
+
+    def stop(self) -> None:
+        self.timer.stop()
+
+    def run(self) -> None:
+        # Такт таймера. Номер такта считается по часам, а не по
+        # количеству срабатываний, поэтому опоздания таймера не сдвигают
+        # расписание
+        now = self._tick_number()
+        for task in list(self.tasks.values()):
+            if now < task.next_tick:
+                continue
+            # Такты, которые задача пропустила из-за опоздания
+            task.missed += (now - task.next_tick) // task.period
+            task.next_tick = (now // task.period + 1) * task.period
+            self.run_task(task)
+
+    @staticmethod
+    def run_task(task: Task) -> None:
+        if task.inputs is not None:
+            # Состояние берется до запуска: данные, изменившиеся во
+            # время работы задачи, будут обработаны в следующий раз
+            state = task.inputs()
+            if state == task.state:
+                task.skips += 1
+                return
+            task.state = state
+
+        start = time.perf_counter()
+        task.callback()
+        elapsed = time.perf_counter() - start
+
+        task.runs += 1
+        task.busy += elapsed
+        task.worst = max(task.worst, elapsed)
+        if elapsed * 1000 > task.interval:
+            task.overruns += 1
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: task.stats() for name, task in self.tasks.items()}
+
+    def report(self) -> str:
+        lines = [f'{name:<8} {v["interval"]:>5} ms  runs={v["runs"]:<6} '
+                 f'skips={v["skips"]:<6} overruns={v["overruns"]:<4} '
+                 f'missed={v["missed"]:<4} max={v["max_ms"]:.1f} ms'
+                 for name, v in self.stats().items()]
+        return '\n'.join(lines) if lines else 'Нет задач'
@@ -0,0 +1,144 @@
+import itertools
+import json
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from modules.breath import BreathDetector
+from modules.recorder import SessionFile
+from modules.samples import Samples
+
+# Параметры, которые можно перебирать, и их значения по умолчанию
+DEFAULTS = {'TimeDelta': 2000, 'MinDeltaTop': 0, 'MaxDeltaTop': 500,
+            'MinDeltaBot': 0, 'MaxDeltaBot': 500, 'window_len': 20,
+            'timer_interval': 100, 'maxChunks': 300}
+
+
+def base_settings(breath_settings: Dict[str, Any]) -> Dict[str, Any]:
+    # Плоские настройки из breath_rec_settings.json
+    detail = breath_settings.get('DetailSettings', {})
+    return {k: breath_settings.get(k, detail.get(k, v))
+            for k, v in DEFAULTS.items()}
+
+
+def expand_grid(grid: Dict[str, Sequence[Any]],
+                base: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Все сочетания значений сетки
+    :param grid: {параметр: [значения]}
+    :param base: Значения остальных параметров
+    """
+    unknown = set(grid) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f'Unknown sweep parameters: {sorted(unknown)}')
+    names = list(grid)
+    return [{**base, **dict(zip(names, values))}
+            for values in itertools.product(*(grid[i] for i in names))]
+
+
+def load_reference(path: str) -> List[float]:
+    """
+    Время вдохов из json файла: список чисел или список записей с
+    полем time, как в логах дыхания
+    """
+    with open(path, encoding='utf-8') as file:
+        data = json.load(file)
+    if isinstance(data, dict):
+        data = list(data.values())
+    return sorted(float(i['time'] if isinstance(i, dict) else i)
+                  for i in data)
+
+
+def group_configs(configs: List[Dict[str, Any]],
+                  parts: int = 1) -> List[List[Dict[str, Any]]]:
+    """
+    Делит конфигурации на части для процессов пула
+    :param parts: Количество частей
+    """
+    size = max(1, -(-len(configs) // max(parts, 1)))
+    return [configs[i:i + size] for i in range(0, len(configs), size)]
+
+
+def create_detector(settings: Dict[str, Any]) -> BreathDetector:
+    detector = BreathDetector()
+    detector.tm_delta = settings['TimeDelta']
+    detector.window_len = settings['window_len']
+    detector.delta_top = [settings['MinDeltaTop'], settings['MaxDeltaTop']]
+    detector.delta_bot = [settings['MinDeltaBot'], settings['MaxDeltaBot']]
+    return detector
+
+
+def replay(data: Samples, configs: List[Dict[str, Any]]) \
+        -> List[Tuple[List[float], float]]:
+    """
+    Распознавание вдохов по записанному сеансу так же, как в анализаторе
+    :param data: Записи сеанса
+    :param configs: Конфигурации
+    :return: Время распознанных вдохов и время работы (с) для каждой
+    конфигурации
+    """
+    results = []
+    for settings in configs:
+        start = time.perf_counter()
+        idx = create_detector(settings).find_all(
+            data, settings['timer_interval'] / 1000, settings['maxChunks'])
+        events = data.times[idx[:, 2]].tolist()
+        results.append((events, time.perf_counter() - start))
+    return results
+
+
+def match_events(events: List[float], reference: List[float],
+                 tolerance: float) -> Dict[str, Any]:
+    """
+    Сопоставление распознанных вдохов с размеченными. Каждому вдоху из
+    разметки соответствует не больше одного ближайшего распознанного
+    :param tolerance: Допустимое расхождение во времени (с)
+    """
+    detected = np.array(events)
+    used = np.zeros(detected.shape[0], bool)
+    offsets = []
+    for ref in reference:
+        if not detected.shape[0]:
+            break
+        diff = np.abs(detected - ref)
+        diff[used] = np.inf
+        idx = int(np.argmin(diff))
+        if diff[idx] <= tolerance:
+            used[idx] = True
+            offsets.append(detected[idx] - ref)
+
+    matched = len(offsets)
+    precision = matched / len(events) if events else 0
+    recall = matched / len(reference) if reference else 0
+    return {'matched': matched,
+            'precision': round(precision, 3), 'recall': round(recall, 3),
+            'f1': round(2 * precision * recall / (precision + recall), 3)
+            if matched else 0,
+            'mean_offset_ms': round(float(np.mean(np.abs(offsets))) * 1000,
+                                    1) if offsets else None}
+
+
+# Данные процесса пула: записи сеанса загружаются один раз на процесс
+_samples: Optional[Samples] = None
+_reference: Optional[List[float]] = None
+_tolerance: float = 0
+
+
+def init_worker(path: str, reference: Optional[List[float]],
+                tolerance: float) -> None:
+    global _samples, _reference, _tolerance
+    _samples = SessionFile(path).samples()
+    _reference, _tolerance = reference, tolerance
+
+
+def run_group(configs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Прогон группы конфигураций в процессе пула
+    results = []
+    for settings, (events, runtime) in zip(configs, replay(_samples, configs)):
+        result = {'settings': settings, 'events': len(events),
+                  'runtime_ms': round(runtime * 1000, 1)}
+        if _reference is not None:
+            result.update(match_events(events, _reference, _tolerance))
+        results.append(result)
+    return results
@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List
+
+import numpy as np
+
+
+class LatencyTracer:
+    """
+    Задержки этапов обработки относительно времени захвата кадра.
+    Этапы кадра:
+        detect - метки найдены в потоке камеры
+        graph - координаты записаны в массив графика
+        analyse - закончен анализ среза с этим кадром
+    Этапы вдоха (от кадра с минимумом всплеска):
+        breath - вдох распознан
+        signal - вдох принят главным окном
+        send - сигнал отправлен на сервер
+    """
+    STAGES = ('detect', 'graph', 'analyse', 'breath', 'signal', 'send')
+
+    def __init__(self, size: int = 2000, events: int = 100) -> None:
+        # Последние задержки каждого этапа (с)
+        self.latencies: Dict[str, deque] = {
+            stage: deque(maxlen=size) for stage in self.STAGES}
+
+        # Последние вдохи с задержками всех их этапов
+        self.events: deque = deque(maxlen=events)
+        self._open_events: Dict[tuple, Dict[str, Any]] = {}
+
+        # Этапы записываются из потоков камеры, интерфейса и сети
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, timestamp: float,
+               trace: int = None) -> float:
+        """
+        Записывает задержку этапа
+        :param stage: Название этапа
+        :param timestamp: Время захвата кадра (time.time())
+        :param trace: Номер кадра. Для этапов вдоха задержка также
+        сохраняется в описание вдоха
+        :return: Задержка (с)
+        """
+        latency = time.time() - timestamp
+        with self._lock:
+            self.latencies[stage].append(latency)
+
+            if trace is not None and stage in ('breath', 'signal', 'send'):
+                # Номера кадров разных камер совпадают, поэтому вдох
+                # определяется номером и временем захвата кадра
+                key = (trace, timestamp)
+                event = self._open_events.get(key)
+                if event is None:
+                    event = {'trace': trace, 'capture': timestamp}
+                    self._open_events[key] = event
+                    self.events.append(event)
+                    # Вдохи, не дошедшие до отправки, не копим
+                    if len(self._open_events) > self.events.maxlen:
+                        self._open_events.pop(next(iter(self._open_events)))
+                event[stage] = round(latency * 1000, 2)
+                if stage == 'send':
+                    self._open_events.pop(key, None)
+        return latency
+
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        # p50/p95/p99 каждого этапа в миллисекундах
+        with self._lock:
+            values = {stage: np.array(v) for stage, v in
+                      self.latencies.items() if v}
+
+        return {stage: {'count': len(v),
+                        **{f'p{p}': round(float(x) * 1000, 2) for p, x in
+                           zip((50, 95, 99), np.percentile(v, (50, 95, 99)))}}
+                for stage, v in values.items()}
+
+    def report(self) -> str:
+        lines = [f'{stage:<8} n={v["count"]:<5} p50={v["p50"]:>8.1f} ms  '
+                 f'p95={v["p95"]:>8.1f} ms  p99={v["p99"]:>8.1f} ms'
+                 for stage, v in self.percentiles().items()]
+        return '\n'.join(lines) if lines else 'Нет данных'
+
+    def last_events(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(i) for i in self.events]
+
+    def dump(self, path: str, extra: Dict[str, Any] = None) -> None:
+        """
+        Сохраняем перцентили и последние вдохи в json файл
+        :param extra: Дополнительные данные, например задержки других
+        процессов
+        """
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'stages': self.percentiles(),
+                       'events': self.last_events(), **(extra or {})}, file,
+                      ensure_ascii=False, indent=1)
+
+    def clear(self) -> None:
+        with self._lock:
+            for v in self.latencies.values():
+                v.clear()
+            self.events.clear()
+            self._open_events.clear()
+
+
+# Общий трассировщик процесса
+tracer = LatencyTracer()
+
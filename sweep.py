@@ -0,0 +1,81 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+from typing import Any, Dict, List
+
+from modules.pipeline import load_json
+from modules.recorder import SessionFile
+from modules.sweep import (base_settings, expand_grid, group_configs,
+                           init_worker, load_reference, run_group)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Перебор настроек распознавания вдоха по записанному '
+                    'сеансу')
+    parser.add_argument('session', help='Файл сеанса (.rec)')
+    parser.add_argument('grid', help='json файл {параметр: [значения]}')
+    parser.add_argument('-r', '--reference',
+                        help='json файл с временем размеченных вдохов')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.5,
+                        help='Допустимое расхождение с разметкой (с)')
+    parser.add_argument('-p', '--processes', type=int,
+                        default=os.cpu_count(), help='Количество процессов')
+    parser.add_argument('-o', '--output', help='Сохранить результаты в json')
+    parser.add_argument('-n', '--top', type=int, default=20,
+                        help='Сколько лучших конфигураций вывести')
+    return parser.parse_args()
+
+
+def print_results(results: List[Dict[str, Any]], names: List[str],
+                  top: int) -> None:
+    # Таблица лучших конфигураций
+    metrics = ['events', 'matched', 'precision', 'recall', 'f1',
+               'mean_offset_ms', 'runtime_ms']
+    metrics = [i for i in metrics if i in results[0]]
+    header = names + metrics
+    rows = [[str(i['settings'][k]) for k in names] +
+            [str(i[k]) for k in metrics] for i in results[:top]]
+    widths = [max(len(h), *(len(r[n]) for r in rows))
+              for n, h in enumerate(header)]
+    for row in [header] + rows:
+        print('  '.join(v.rjust(w) for v, w in zip(row, widths)))
+
+
+def main() -> None:
+    args = parse_args()
+    with open(args.grid, encoding='utf-8') as file:
+        grid = json.load(file)
+
+    base = base_settings(load_json('data/settings/breath_rec_settings.json'))
+    configs = expand_grid(grid, base)
+    reference = load_reference(args.reference) if args.reference else None
+    session = SessionFile(args.session)
+    print(f'{len(configs)} configurations, {len(session)} samples, '
+          f'{args.processes} processes')
+
+    start = time.perf_counter()
+    groups = group_configs(configs, args.processes)
+    with mp.Pool(args.processes, init_worker,
+                 (args.session, reference, args.tolerance)) as pool:
+        results = [i for group in pool.imap_unordered(run_group, groups)
+                   for i in group]
+    elapsed = time.perf_counter() - start
+
+    # Лучшие - по совпадению с разметкой, без нее - по количеству вдохов
+    key = 'f1' if reference is not None else 'events'
+    results.sort(key=lambda i: (i[key], -i['runtime_ms']), reverse=True)
+    print_results(results, list(grid), args.top)
+    print(f'Done in {elapsed:.1f} s')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'session': args.session, 'grid': grid,
+                       'reference': args.reference, 'results': results},
+                      file, ensure_ascii=False, indent=1)
+
+
+if __name__ == '__main__':
+    main()